@@ -0,0 +1,213 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Generic, List, Optional, Set, Tuple, TypeVar, Union
+
+from .types import Mat
+
+__all__ = ["AsyncOcr", "map_ocr"]
+
+
+R = TypeVar("R")
+
+BatchFunction = Callable[[List[Mat]], List[Union[R, BaseException]]]
+
+
+def map_ocr(ocr: Callable[[Mat], R], imgs: List[Mat]) -> List[Union[R, BaseException]]:
+    """
+    Apply a single image `ocr` to every image, with the exceptions in place
+    of the results. Wrap it in `functools.partial` to make a batch function
+    of `AsyncOcr`.
+    """
+    results: List[Union[R, BaseException]] = []
+    for img in imgs:
+        try:
+            results.append(ocr(img))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            results.append(e)
+    return results
+
+
+class AsyncOcr(Generic[R]):
+    """
+    An asyncio facade that runs a CPU-bound OCR pipeline on an executor, so
+    that the event loop is never blocked.
+
+    Requests arriving within `batch_window` seconds of each other are
+    grouped, up to `max_batch_size`, into one call of `batch_function`, so
+    that e.g. `DeviceOcrBatchRunner` classifies their digits and looks up
+    their jackets in one batch. At most `max_concurrency` batches run at once,
+    further requests wait in line.
+
+    Cancelling an `ocr_async` call that has not started yet drops its image
+    from the batch. Once the batch runs, the work is not interrupted, but the
+    result is discarded.
+
+    ```py
+    with DeviceOcrBatchRunner("knn.dat", "phash.db", max_workers=4) as runner:
+        async with AsyncOcr(runner, max_workers=4) as async_ocr:
+            result = await async_ocr.ocr_async(img)
+    ```
+
+    `ChieriBotV4Ocr` and other single image pipelines work through
+    `functools.partial(map_ocr, chieri_ocr.ocr)`.
+    """
+
+    def __init__(
+        self,
+        batch_function: BatchFunction,
+        *,
+        executor: Optional[Executor] = None,
+        use_processes: bool = False,
+        max_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        batch_window: float = 0.005,
+        max_batch_size: int = 16,
+    ):
+        """
+        :param batch_function: takes a list of images and returns a result or
+            an exception for each of them. It must be picklable with
+            processes.
+        :param executor: run on this executor, which the caller keeps owning.
+            Otherwise a `ThreadPoolExecutor`, or a spawning
+            `ProcessPoolExecutor` with `use_processes`, of `max_workers`
+            (`os.cpu_count()` by default) is created and shut down by
+            `aclose`.
+        :param max_concurrency: the number of batches running at once. By
+            default the worker count of a created executor, unlimited for a
+            given one.
+        :param batch_window: seconds to wait for more requests after the first
+            one of a batch, `0` to only group requests of the same loop
+            iteration
+        """
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be greater than 0")
+        if max_concurrency is not None and max_concurrency <= 0:
+            raise ValueError("max_concurrency must be greater than 0")
+
+        self.batch_function = batch_function
+        self.owns_executor = executor is None
+        if executor is None:
+            max_workers = max_workers or os.cpu_count() or 1
+            if use_processes:
+                # forking a process with running threads, like the event
+                # loop's, can deadlock the children
+                executor = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                executor = ThreadPoolExecutor(max_workers=max_workers)
+            if max_concurrency is None:
+                max_concurrency = max_workers
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self._pending: List[Tuple[Mat, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # created on first use, inside the running loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._closed = False
+
+    async def ocr_async(self, img: Mat) -> R:
+        if self._closed:
+            raise RuntimeError("AsyncOcr is closed")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((img, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Mat, asyncio.Future]]):
+        if self.max_concurrency is not None and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        acquired = False
+        try:
+            if self._semaphore is not None:
+                await self._semaphore.acquire()
+                acquired = True
+
+            # drop the requests cancelled while waiting
+            batch = [(img, future) for img, future in batch if not future.done()]
+            if not batch:
+                return
+
+            loop = asyncio.get_running_loop()
+            run = functools.partial(self.batch_function, [img for img, _ in batch])
+            try:
+                results = list(await loop.run_in_executor(self.executor, run))
+                if len(results) != len(batch):
+                    raise ValueError(
+                        f"batch_function returned {len(results)} results "
+                        f"for {len(batch)} images"
+                    )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            # cancelled by `aclose`, possibly still waiting for the semaphore
+            for _, future in batch:
+                future.cancel()
+            raise
+        finally:
+            if acquired:
+                self._semaphore.release()
+
+    async def aclose(self):
+        """
+        Cancel the waiting requests and the batches not yet finished, then
+        shut down the executor if it was created here.
+        """
+        self._closed = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.owns_executor:
+            # do not block the loop while the running batches finish
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.executor.shutdown
+            )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
@@ -4,12 +4,19 @@ from typing import List, Optional, Tuple
 import cv2
 import numpy as np
 
+from ....color import HsvRangeClassifier
 from ....crop import crop_xywh
 from ....ocr import (
+    ConnectedComponents,
     FixRects,
-    ocr_digits_by_contour_knn,
+    KnnGlyphMemo,
+    knn_classify_digits_batch,
+    knn_find_nearest_batch,
+    normalize_digits,
+    ocr_digit_samples_knn,
+    ocr_digits_by_components_get_digits,
+    ocr_digits_by_contour_get_digits,
     preprocess_hog,
-    resize_fill_square,
 )
 from ....phash_db import ImagePhashDatabase
 from ....types import Mat
@@ -18,6 +25,18 @@ from ...shared import B30OcrResultItem
 from .colors import *
 from .rois import ChieriBotV4Rois
 
+# prs, ftr, byd only
+RATING_CLASS_CLASSIFIER = HsvRangeClassifier(
+    [(PRS_MIN_HSV, PRS_MAX_HSV), (FTR_MIN_HSV, FTR_MAX_HSV), (BYD_MIN_HSV, BYD_MAX_HSV)]
+)
+PFL_BG_CLASSIFIER = HsvRangeClassifier(
+    [
+        (PURE_BG_MIN_HSV, PURE_BG_MAX_HSV),
+        (FAR_BG_MIN_HSV, FAR_BG_MAX_HSV),
+        (LOST_BG_MIN_HSV, LOST_BG_MAX_HSV),
+    ]
+)
+
 
 class ChieriBotV4Ocr:
     def __init__(
@@ -26,11 +45,26 @@ class ChieriBotV4Ocr:
         pfl_knn: cv2.ml.KNearest,
         phash_db: ImagePhashDatabase,
         factor: Optional[float] = 1.0,
+        *,
+        use_connected_components: bool = False,
+        score_glyph_memo: Optional[KnnGlyphMemo] = None,
+        pfl_glyph_memo: Optional[KnnGlyphMemo] = None,
     ):
+        """
+        :param use_connected_components: segment digits with
+            `ConnectedComponents` instead of `cv2.findContours`, see
+            `DeviceOcr`.
+        :param score_glyph_memo: a `KnnGlyphMemo` of `score_knn` and `k=4`
+            that `ocr` classifies score digits through
+        :param pfl_glyph_memo: the same for `pfl_knn` and pure/far/lost digits
+        """
         self.__score_knn = score_knn
         self.__pfl_knn = pfl_knn
         self.__phash_db = phash_db
         self.__rois = ChieriBotV4Rois(factor)
+        self.use_connected_components = use_connected_components
+        self.score_glyph_memo = score_glyph_memo
+        self.pfl_glyph_memo = pfl_glyph_memo
 
     @property
     def score_knn(self):
@@ -76,28 +110,28 @@ class ChieriBotV4Ocr:
             self.rois.component_rois.rating_class_rect
         )
         rating_class_roi = crop_xywh(component_bgr, rating_class_rect)
-        rating_class_roi = cv2.cvtColor(rating_class_roi, cv2.COLOR_BGR2HSV)
-        rating_class_masks = [
-            cv2.inRange(rating_class_roi, PRS_MIN_HSV, PRS_MAX_HSV),
-            cv2.inRange(rating_class_roi, FTR_MIN_HSV, FTR_MAX_HSV),
-            cv2.inRange(rating_class_roi, BYD_MIN_HSV, BYD_MAX_HSV),
-        ]  # prs, ftr, byd only
-        rating_class_results = [np.count_nonzero(m) for m in rating_class_masks]
+        rating_class_results = RATING_CLASS_CLASSIFIER.counts_bgr(rating_class_roi)
         if max(rating_class_results) < 70:
             return 0
         else:
             return max(enumerate(rating_class_results), key=lambda i: i[1])[0] + 1
 
-    def ocr_component_song_id(self, component_bgr: Mat):
+    def component_jacket_roi_gray(self, component_bgr: Mat) -> Mat:
         jacket_rect = construct_int_xywh_rect(
             self.rois.component_rois.jacket_rect, floor
         )
-        jacket_roi = cv2.cvtColor(
-            crop_xywh(component_bgr, jacket_rect), cv2.COLOR_BGR2GRAY
-        )
+        return cv2.cvtColor(crop_xywh(component_bgr, jacket_rect), cv2.COLOR_BGR2GRAY)
+
+    def ocr_component_song_id(self, component_bgr: Mat):
+        jacket_roi = self.component_jacket_roi_gray(component_bgr)
         return self.phash_db.lookup_jacket(jacket_roi)[0]
 
-    def ocr_component_score_knn(self, component_bgr: Mat) -> int:
+    def ocr_components_song_id(self, components_bgr: List[Mat]) -> List[str]:
+        jacket_rois = [self.component_jacket_roi_gray(c) for c in components_bgr]
+        results = self.phash_db.lookup_jackets_batch(jacket_rois, limit=1)
+        return [result[0][0] for result in results]
+
+    def component_score_digits(self, component_bgr: Mat):
         # sourcery skip: inline-immediately-returned-variable
         score_rect = construct_int_xywh_rect(self.rois.component_rois.score_rect)
         score_roi = cv2.cvtColor(
@@ -109,6 +143,15 @@ class ChieriBotV4Ocr:
         if score_roi[1][1] == 255:
             score_roi = 255 - score_roi
 
+        if self.use_connected_components:
+            components = ConnectedComponents.from_image(score_roi)
+            components = components.select(
+                components.rects[:, 3] > score_roi.shape[0] * 0.5
+            )
+            return ocr_digits_by_components_get_digits(
+                components.erase_others(score_roi), 20, components
+            )
+
         contours, _ = cv2.findContours(
             score_roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
@@ -117,7 +160,15 @@ class ChieriBotV4Ocr:
             if rect[3] > score_roi.shape[0] * 0.5:
                 continue
             score_roi = cv2.fillPoly(score_roi, [contour], 0)
-        return ocr_digits_by_contour_knn(score_roi, self.score_knn)
+        return ocr_digits_by_contour_get_digits(score_roi, 20)
+
+    def component_score_samples(self, component_bgr: Mat):
+        return preprocess_hog(self.component_score_digits(component_bgr))
+
+    def ocr_component_score_knn(self, component_bgr: Mat) -> int:
+        return ocr_digit_samples_knn(
+            self.component_score_samples(component_bgr), self.score_knn
+        )
 
     def find_pfl_rects(self, component_pfl_processed: Mat) -> List[List[int]]:
         # sourcery skip: inline-immediately-returned-variable
@@ -153,12 +204,7 @@ class ChieriBotV4Ocr:
         # fill the pfl bg with background color
         bg_point = [round(i) for i in self.rois.component_rois.bg_point]
         bg_color = component_bgr[bg_point[1]][bg_point[0]]
-        pure_bg_mask = cv2.inRange(pfl_roi_hsv, PURE_BG_MIN_HSV, PURE_BG_MAX_HSV)
-        far_bg_mask = cv2.inRange(pfl_roi_hsv, FAR_BG_MIN_HSV, FAR_BG_MAX_HSV)
-        lost_bg_mask = cv2.inRange(pfl_roi_hsv, LOST_BG_MIN_HSV, LOST_BG_MAX_HSV)
-        pfl_roi[np.where(pure_bg_mask != 0)] = bg_color
-        pfl_roi[np.where(far_bg_mask != 0)] = bg_color
-        pfl_roi[np.where(lost_bg_mask != 0)] = bg_color
+        pfl_roi[PFL_BG_CLASSIFIER.labels(pfl_roi_hsv) != 0] = bg_color
 
         # threshold
         pfl_roi = cv2.cvtColor(pfl_roi, cv2.COLOR_BGR2GRAY)
@@ -184,60 +230,121 @@ class ChieriBotV4Ocr:
         )
         return result_eroded if len(self.find_pfl_rects(result_eroded)) == 3 else result
 
-    def ocr_component_pfl(
-        self, component_bgr: Mat
-    ) -> Tuple[Optional[int], Optional[int], Optional[int]]:
-        try:
-            pfl_roi = self.preprocess_component_pfl(component_bgr)
-            pfl_rects = self.find_pfl_rects(pfl_roi)
-            pure_far_lost = []
-            for pfl_roi_rect in pfl_rects:
-                roi = crop_xywh(pfl_roi, pfl_roi_rect)
+    def component_pfl_digits(self, component_bgr: Mat) -> List[np.ndarray]:
+        """Normalized digits of the pure, far and lost rows, in this order."""
+        pfl_roi = self.preprocess_component_pfl(component_bgr)
+        pfl_rects = self.find_pfl_rects(pfl_roi)
+        pfl_digits = []
+        for pfl_roi_rect in pfl_rects:
+            roi = crop_xywh(pfl_roi, pfl_roi_rect)
+            if self.use_connected_components:
+                digit_rects = ConnectedComponents.from_image(roi).rect_tuples()
+            else:
                 digit_contours, _ = cv2.findContours(
                     roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
                 )
                 digit_rects = [cv2.boundingRect(c) for c in digit_contours]
-                digit_rects = FixRects.connect_broken(
-                    digit_rects, roi.shape[1], roi.shape[0]
-                )
-                digit_rects = FixRects.split_connected(roi, digit_rects)
-                digit_rects = sorted(digit_rects, key=lambda r: r[0])
-                digits = []
-                for digit_rect in digit_rects:
-                    digit = crop_xywh(roi, digit_rect)
-                    digit = resize_fill_square(digit, 20)
-                    digits.append(digit)
-                samples = preprocess_hog(digits)
-
-                _, results, _, _ = self.pfl_knn.findNearest(samples, 4)
-                results = [str(int(i)) for i in results.ravel()]
-                pure_far_lost.append(int("".join(results)))
-            return tuple(pure_far_lost)
+            digit_rects = FixRects.connect_broken(
+                digit_rects, roi.shape[1], roi.shape[0]
+            )
+            digit_rects = FixRects.split_connected(roi, digit_rects)
+            digit_rects = sorted(digit_rects, key=lambda r: r[0])
+            pfl_digits.append(normalize_digits(roi, digit_rects, 20))
+        return pfl_digits
+
+    def component_pfl_samples(self, component_bgr: Mat) -> List[np.ndarray]:
+        """Digit samples of the pure, far and lost rows, in this order."""
+        return [preprocess_hog(d) for d in self.component_pfl_digits(component_bgr)]
+
+    @staticmethod
+    def pfl_labels_to_ints(pfl_labels: List[np.ndarray]) -> Tuple[int, ...]:
+        return tuple(int("".join(str(int(i)) for i in labels)) for labels in pfl_labels)
+
+    def ocr_component_pfl(
+        self, component_bgr: Mat
+    ) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        try:
+            pfl_samples = self.component_pfl_samples(component_bgr)
+            return self.pfl_labels_to_ints(
+                knn_find_nearest_batch(pfl_samples, self.pfl_knn)
+            )
         except Exception:
             return (None, None, None)
 
-    def ocr_component(self, component_bgr: Mat) -> B30OcrResultItem:
-        component_blur = cv2.GaussianBlur(component_bgr, (5, 5), 0)
-        rating_class = self.ocr_component_rating_class(component_blur)
-        song_id = self.ocr_component_song_id(component_bgr)
-        # title = self.ocr_component_title(component_blur)
-        # score = self.ocr_component_score(component_blur)
-        score = self.ocr_component_score_knn(component_bgr)
-        pure, far, lost = self.ocr_component_pfl(component_bgr)
-        return B30OcrResultItem(
-            song_id=song_id,
-            rating_class=rating_class,
-            # title=title,
-            score=score,
-            pure=pure,
-            far=far,
-            lost=lost,
-            date=None,
+    def ocr_components(
+        self, components_bgr: List[Mat], song_ids: List[str]
+    ) -> List[B30OcrResultItem]:
+        # collect the digits of every component first, then classify them
+        # with one `findNearest` call per model
+        rating_classes = []
+        score_digits = []
+        pfl_digits = []
+        for component_bgr in components_bgr:
+            component_blur = cv2.GaussianBlur(component_bgr, (5, 5), 0)
+            rating_classes.append(self.ocr_component_rating_class(component_blur))
+            score_digits.append(self.component_score_digits(component_bgr))
+            try:
+                pfl_digits.append(self.component_pfl_digits(component_bgr))
+            except Exception:
+                pfl_digits.append(None)
+
+        score_results = knn_classify_digits_batch(
+            score_digits, self.score_knn, memo=self.score_glyph_memo
+        )
+        pfl_results = knn_classify_digits_batch(
+            [digits for rows in pfl_digits if rows is not None for digits in rows],
+            self.pfl_knn,
+            memo=self.pfl_glyph_memo,
         )
 
+        results = []
+        offset = 0
+        for song_id, rating_class, score, rows in zip(
+            song_ids, rating_classes, score_results, pfl_digits
+        ):
+            pfl = (None, None, None)
+            pfl_confidences = (None, None, None)
+            if rows is not None:
+                component_pfl_results = pfl_results[offset : offset + len(rows)]
+                offset += len(rows)
+                try:
+                    pfl = self.pfl_labels_to_ints(
+                        [r.labels for r in component_pfl_results]
+                    )
+                    pfl_confidences = tuple(
+                        r.confidence() for r in component_pfl_results
+                    )
+                except Exception:
+                    pass
+            pure, far, lost = pfl
+            pure_confidence, far_confidence, lost_confidence = pfl_confidences
+            results.append(
+                B30OcrResultItem(
+                    song_id=song_id,
+                    rating_class=rating_class,
+                    # title=title,
+                    score=score.value(),
+                    pure=pure,
+                    far=far,
+                    lost=lost,
+                    date=None,
+                    score_confidence=score.confidence(),
+                    pure_confidence=pure_confidence,
+                    far_confidence=far_confidence,
+                    lost_confidence=lost_confidence,
+                )
+            )
+        return results
+
+    def ocr_component(
+        self, component_bgr: Mat, *, song_id: Optional[str] = None
+    ) -> B30OcrResultItem:
+        if song_id is None:
+            song_id = self.ocr_component_song_id(component_bgr)
+        return self.ocr_components([component_bgr], [song_id])[0]
+
     def ocr(self, img_bgr: Mat) -> List[B30OcrResultItem]:
         self.set_factor(img_bgr)
-        return [
-            self.ocr_component(component_bgr)
-            for component_bgr in self.rois.components(img_bgr)
-        ]
+        components_bgr = self.rois.components(img_bgr)
+        song_ids = self.ocr_components_song_id(components_bgr)
+        return self.ocr_components(components_bgr, song_ids)
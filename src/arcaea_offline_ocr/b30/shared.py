@@ -14,3 +14,7 @@ class B30OcrResultItem:
     date: Optional[datetime] = None
     title: Optional[str] = None
     song_id: Optional[str] = None
+    score_confidence: Optional[float] = None
+    pure_confidence: Optional[float] = None
+    far_confidence: Optional[float] = None
+    lost_confidence: Optional[float] = None
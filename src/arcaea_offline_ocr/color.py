@@ -0,0 +1,74 @@
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .types import Mat
+
+__all__ = ["HsvRangeClassifier"]
+
+
+class HsvRangeClassifier:
+    """
+    Count the pixels of an image inside several `cv2.inRange` ranges in one
+    pass.
+
+    The ranges are compiled into per-channel lookup tables whose entries are
+    bit sets of the ranges containing that channel value. A pixel's label is
+    the bitwise and of its three channel entries, and one histogram of the
+    labels gives the counts of all ranges. Ranges may overlap, a pixel counts
+    towards every range it is in, exactly like separate `cv2.inRange` masks.
+    """
+
+    MAX_RANGES = 8
+
+    def __init__(self, ranges: Sequence[Tuple[Sequence[int], Sequence[int]]]):
+        """
+        :param ranges: inclusive `(lower, upper)` bounds of the three
+            channels, e.g. the `*_HSV_MIN` and `*_HSV_MAX` constants
+        """
+        if not 0 < len(ranges) <= self.MAX_RANGES:
+            raise ValueError(
+                f"Expected 1 to {self.MAX_RANGES} ranges, got {len(ranges)}"
+            )
+
+        # one table per channel, `cv2.LUT` is much faster on single channels
+        self.luts = np.zeros((3, 256), np.uint8)
+        for bit, (lower, upper) in enumerate(ranges):
+            for channel in range(3):
+                # python ints, `uint8(255) + 1` wraps to 0 on NumPy 2
+                start, stop = int(lower[channel]), int(upper[channel]) + 1
+                self.luts[channel, start:stop] |= 1 << bit
+
+        labels = np.arange(256)
+        # label value -> ranges containing it
+        self.label_ranges = (labels >> np.arange(len(ranges))[:, np.newaxis]) & 1
+
+    def __len__(self):
+        return len(self.label_ranges)
+
+    def labels(self, img_hsv: Mat) -> Mat:
+        """The bit set of the ranges containing each pixel, as a `uint8` image."""
+        h, s, v = (
+            cv2.LUT(plane, lut) for plane, lut in zip(cv2.split(img_hsv), self.luts)
+        )
+        return cv2.bitwise_and(cv2.bitwise_and(h, s), v)
+
+    def counts(self, img_hsv: Mat) -> List[int]:
+        """The pixel count of every range."""
+        labels = self.labels(img_hsv)
+        if labels.size < 1 << 24:
+            # float32 bins are exact below 2**24 pixels
+            histogram = cv2.calcHist([labels], [0], None, [256], [0, 256])
+            histogram = histogram.ravel().astype(np.int64)
+        else:
+            histogram = np.bincount(labels.ravel(), minlength=256)
+        return (self.label_ranges @ histogram).tolist()
+
+    def counts_bgr(self, img_bgr: Mat) -> List[int]:
+        return self.counts(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV))
+
+    def classify(self, img_hsv: Mat) -> int:
+        """The index of the range with the most pixels, the first one on ties."""
+        counts = self.counts(img_hsv)
+        return counts.index(max(counts))
@@ -1,12 +1,13 @@
 import math
-from typing import Tuple
+from typing import Hashable, Optional, Tuple
 
 import cv2
 import numpy as np
 
+from .cache import LruCache
 from .types import Mat
 
-__all__ = ["crop_xywh", "CropBlackEdges"]
+__all__ = ["crop_xywh", "CropBlackEdges", "LetterboxProfileCache"]
 
 
 def crop_xywh(mat: Mat, rect: Tuple[int, int, int, int]):
@@ -14,6 +15,9 @@ def crop_xywh(mat: Mat, rect: Tuple[int, int, int, int]):
     return mat[y : y + h, x : x + w]
 
 
+_EDGE_CHUNK = 16
+
+
 class CropBlackEdges:
     @staticmethod
     def is_black_edge(__img_gray_slice: Mat, black_pixel: int, ratio: float = 0.6):
@@ -22,45 +26,230 @@ class CropBlackEdges:
             __img_gray_slice.size * ratio
         )
 
+    @staticmethod
+    def _non_black_lines(
+        img_gray: Mat, black_pixel: int, axis: int, start: int, stop: int
+    ) -> np.ndarray:
+        """
+        Indices of the columns (`axis=0`) or rows (`axis=1`) in `[start, stop)`
+        that are not `is_black_edge`, with one reduction over the slice.
+        """
+        lines = img_gray[:, start:stop] if axis == 0 else img_gray[start:stop]
+        counts = np.count_nonzero(lines < black_pixel, axis=axis)
+        limit = math.floor(img_gray.shape[axis] * 0.6)
+        return start + np.flatnonzero(counts <= limit)
+
     @classmethod
-    def get_crop_rect(cls, img_gray: Mat, black_threshold: int = 25):
-        height, width = img_gray.shape[:2]
-        left = 0
-        right = width
-        top = 0
-        bottom = height
-
-        for i in range(width):
-            column = img_gray[:, i]
-            if not cls.is_black_edge(column, black_threshold):
-                break
-            left += 1
+    def _edges(
+        cls,
+        img_gray: Mat,
+        black_pixel: int,
+        axis: int,
+        leading_stop: int = _EDGE_CHUNK,
+        trailing_start: Optional[int] = None,
+    ) -> Tuple[int, int]:
+        """
+        `(start, stop)` of the columns or rows left after stripping the black
+        ones at both ends, with the same rules as the line-by-line scan.
 
-        for i in sorted(range(width), reverse=True):
-            column = img_gray[:, i]
-            if i <= left + 1 or not cls.is_black_edge(column, black_threshold):
-                break
-            right -= 1
+        Lines are counted in chunks that grow inwards from both ends, the
+        first chunks being `[0, leading_stop)` and `[trailing_start, size)`.
+        """
+        size = img_gray.shape[1 - axis]
 
-        for i in range(height):
-            row = img_gray[i]
-            if not cls.is_black_edge(row, black_threshold):
-                break
-            top += 1
+        leading = None
+        start, stop = 0, min(size, max(leading_stop, 1))
+        while leading is None:
+            non_black = cls._non_black_lines(img_gray, black_pixel, axis, start, stop)
+            if len(non_black):
+                leading = int(non_black[0])
+            elif stop >= size:
+                leading = size
+            else:
+                start, stop = stop, min(size, stop + 2 * (stop - start))
 
-        for i in sorted(range(height), reverse=True):
-            row = img_gray[i]
-            if i <= top + 1 or not cls.is_black_edge(row, black_threshold):
+        # the trailing scan never strips the line after `leading`, so only the
+        # lines from `leading + 2` on are counted
+        lowest = leading + 2
+        last_non_black = leading + 1
+        stop = size
+        if trailing_start is None:
+            trailing_start = size - _EDGE_CHUNK
+        start = min(trailing_start, size - 1)
+        while stop > lowest:
+            start = max(start, lowest)
+            non_black = cls._non_black_lines(img_gray, black_pixel, axis, start, stop)
+            if len(non_black):
+                last_non_black = int(non_black[-1])
                 break
-            bottom -= 1
+            start, stop = start - 2 * (stop - start), start
+        return leading, min(size, last_non_black + 1)
 
+    @classmethod
+    def get_crop_rect(
+        cls,
+        img_gray: Mat,
+        black_threshold: int = 25,
+        *,
+        coarse_step: Optional[int] = None,
+    ):
+        """
+        :param coarse_step: if greater than 1, first locate the edges roughly
+            on the image subsampled by this step, so that the exact counting
+            starts near them. Useful for wide letterboxes, the result is the
+            same.
+        """
+        edges = []
+        for axis in (0, 1):
+            hints = {}
+            if coarse_step is not None and coarse_step > 1:
+                img_coarse = img_gray[::coarse_step, ::coarse_step]
+                non_black = cls._non_black_lines(
+                    img_coarse, black_threshold, axis, 0, img_coarse.shape[1 - axis]
+                )
+                if len(non_black):
+                    hints["leading_stop"] = (int(non_black[0]) + 2) * coarse_step
+                    hints["trailing_start"] = (int(non_black[-1]) - 2) * coarse_step
+            edges.append(cls._edges(img_gray, black_threshold, axis, **hints))
+
+        (left, right), (top, bottom) = edges
         assert right > left, "cropped width < 0"
         assert bottom > top, "cropped height < 0"
         return (left, top, right - left, bottom - top)
 
     @classmethod
     def crop(
-        cls, img: Mat, convert_flag: cv2.COLOR_BGR2GRAY, black_threshold: int = 25
+        cls,
+        img: Mat,
+        convert_flag: cv2.COLOR_BGR2GRAY,
+        black_threshold: int = 25,
+        *,
+        coarse_step: Optional[int] = None,
+        profile_cache: Optional["LetterboxProfileCache"] = None,
+        device: Optional[Hashable] = None,
     ) -> Mat:
-        rect = cls.get_crop_rect(cv2.cvtColor(img, convert_flag), black_threshold)
+        """
+        :param profile_cache: reuse the rect of earlier images with the same
+            resolution and `device`, see `LetterboxProfileCache`
+        """
+        if profile_cache is not None:
+            rect = profile_cache.get_crop_rect(
+                img,
+                convert_flag,
+                black_threshold,
+                device=device,
+                coarse_step=coarse_step,
+            )
+        else:
+            rect = cls.get_crop_rect(
+                cv2.cvtColor(img, convert_flag),
+                black_threshold,
+                coarse_step=coarse_step,
+            )
         return crop_xywh(img, rect)
+
+
+class LetterboxProfileCache:
+    """
+    Remembers the `CropBlackEdges` rect of every image resolution, optionally
+    per device tag, since screenshots of the same device share their black
+    bar geometry.
+
+    On a hit, only a few columns and rows just inside and outside the cached
+    edges are converted to gray and checked. If any of them disagrees, the
+    rect is computed from the whole image again and replaces the cached one.
+    The check samples lines, so an image whose bars differ only between the
+    sampled lines gets the cached rect.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.profiles: LruCache[Tuple[int, int, int, int]] = LruCache(maxsize)
+        self.mismatches = 0
+
+    @staticmethod
+    def _line_is_black(
+        img: Mat,
+        convert_flag: Optional[int],
+        black_threshold: int,
+        axis: int,
+        index: int,
+    ) -> bool:
+        line = img[:, index : index + 1] if axis == 0 else img[index : index + 1]
+        if convert_flag is not None:
+            line = cv2.cvtColor(line, convert_flag)
+        return CropBlackEdges.is_black_edge(line, black_threshold)
+
+    @classmethod
+    def validate(
+        cls,
+        img: Mat,
+        rect: Tuple[int, int, int, int],
+        convert_flag: Optional[int] = None,
+        black_threshold: int = 25,
+    ) -> bool:
+        """
+        Whether `rect` is consistent with the black edges of `img` at the
+        sampled lines: the first, middle and last line of every bar are
+        black, and the lines just inside the rect are not.
+
+        :param convert_flag: the `cv2.cvtColor` flag to convert `img` to gray,
+            `None` if `img` is already gray
+        """
+        x, y, w, h = rect
+        for axis, leading, stop in ((0, x, x + w), (1, y, y + h)):
+            size = img.shape[1 - axis]
+            if not 0 <= leading < stop <= size:
+                return False
+
+            black_lines = {0, leading // 2, leading - 1} if leading > 0 else set()
+            if stop < size:
+                black_lines |= {stop, (stop + size - 1) // 2, size - 1}
+            non_black_lines = {leading} if leading < size else set()
+            # the trailing scan never strips the line after `leading`
+            if stop - 1 > leading + 1:
+                non_black_lines.add(stop - 1)
+
+            for lines, expected in ((black_lines, True), (non_black_lines, False)):
+                for index in lines:
+                    if (
+                        cls._line_is_black(
+                            img, convert_flag, black_threshold, axis, index
+                        )
+                        != expected
+                    ):
+                        return False
+        return True
+
+    def get_crop_rect(
+        self,
+        img: Mat,
+        convert_flag: Optional[int] = None,
+        black_threshold: int = 25,
+        *,
+        device: Optional[Hashable] = None,
+        coarse_step: Optional[int] = None,
+    ) -> Tuple[int, int, int, int]:
+        """
+        The `CropBlackEdges.get_crop_rect` of `img`, from the profile of its
+        resolution and `device` when that still fits.
+
+        :param convert_flag: the `cv2.cvtColor` flag to convert `img` to gray,
+            `None` if `img` is already gray
+        """
+        key = (img.shape[0], img.shape[1], black_threshold, device)
+        rect = self.profiles.get(key)
+        if rect is not None:
+            if self.validate(img, rect, convert_flag, black_threshold):
+                return rect
+            self.mismatches += 1
+
+        img_gray = img if convert_flag is None else cv2.cvtColor(img, convert_flag)
+        rect = CropBlackEdges.get_crop_rect(
+            img_gray, black_threshold, coarse_step=coarse_step
+        )
+        self.profiles.put(key, rect)
+        return rect
+
+    def clear(self):
+        self.profiles.clear()
+        self.mismatches = 0
@@ -1,2 +1,3 @@
+from .batch import DeviceOcrBatchItem, DeviceOcrBatchRunner, ocr_device_batch
 from .common import DeviceOcrResult
 from .ocr import DeviceOcr
@@ -0,0 +1,382 @@
+import multiprocessing
+import os
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+import attrs
+import cv2
+
+from ..phash_db import (
+    ImagePhashDatabase,
+    SharedPhashDatabaseDescriptor,
+    attach_shared_phash_database,
+)
+from ..types import Mat
+from ..utils import imread_unicode
+from .common import DeviceOcrResult
+from .ocr import DeviceOcr
+from .rois.definition import DeviceRois, DeviceRoisAutoT2
+from .rois.extractor import DeviceRoisExtractor
+from .rois.masker import DeviceRoisMasker, DeviceRoisMaskerAutoT2
+
+__all__ = ["DeviceOcrBatchItem", "DeviceOcrBatchRunner", "ocr_device_batch"]
+
+
+BatchInput = Union[str, "os.PathLike[str]", Mat]
+
+
+@attrs.define
+class DeviceOcrBatchItem:
+    index: int
+    """Position of the input in the batch"""
+    path: Optional[str] = None
+    """The input path, `None` for array inputs"""
+    result: Optional[DeviceOcrResult] = None
+    error: Optional[str] = None
+    """The exception message if reading or recognizing the input failed"""
+    traceback: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+KnnModelSource = Union[str, "os.PathLike[str]", cv2.ml.KNearest]
+PhashDatabaseSource = Union[
+    str, "os.PathLike[str]", SharedPhashDatabaseDescriptor, ImagePhashDatabase
+]
+
+
+@attrs.define
+class _WorkerConfig:
+    knn_model: KnnModelSource
+    phash_db: PhashDatabaseSource
+    rois_type: Callable[[int, int], DeviceRois]
+    masker: DeviceRoisMasker
+    device_ocr_kwargs: Dict[str, Any]
+
+
+class _Worker:
+    def __init__(self, config: _WorkerConfig):
+        self.config = config
+        if isinstance(config.knn_model, cv2.ml.KNearest):
+            self.knn_model = config.knn_model
+        else:
+            self.knn_model = cv2.ml.KNearest.load(os.fspath(config.knn_model))
+        if isinstance(config.phash_db, ImagePhashDatabase):
+            self.phash_db = config.phash_db
+        elif isinstance(config.phash_db, SharedPhashDatabaseDescriptor):
+            self.phash_db = attach_shared_phash_database(config.phash_db)
+        else:
+            self.phash_db = ImagePhashDatabase(os.fspath(config.phash_db))
+
+    def device_ocr(self, img: Mat) -> DeviceOcr:
+        rois = self.config.rois_type(img.shape[1], img.shape[0])
+        return DeviceOcr(
+            DeviceRoisExtractor(img, rois),
+            self.config.masker,
+            self.knn_model,
+            self.phash_db,
+            **self.config.device_ocr_kwargs,
+        )
+
+    def ocr(self, img: Mat) -> DeviceOcrResult:
+        return self.device_ocr(img).ocr()
+
+    def ocr_batch(self, imgs: List[Mat]) -> List[Union[DeviceOcrResult, Exception]]:
+        """
+        `DeviceOcr.ocr_batch`, or one `DeviceOcr.ocr` per image with the
+        exceptions in place of the results if the batch fails.
+        """
+        try:
+            return DeviceOcr.ocr_batch([self.device_ocr(img) for img in imgs])
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
+
+        results: List[Union[DeviceOcrResult, Exception]] = []
+        for img in imgs:
+            try:
+                results.append(self.ocr(img))
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                results.append(e)
+        return results
+
+    def run(self, index: int, item: BatchInput) -> DeviceOcrBatchItem:
+        path = _item_path(item)
+        try:
+            if isinstance(item, Mat):
+                img = item
+            else:
+                img = imread_unicode(os.fspath(item), cv2.IMREAD_COLOR)
+                if img is None:
+                    raise ValueError(f"Cannot read image {path!r}")
+            return DeviceOcrBatchItem(index=index, path=path, result=self.ocr(img))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return _error_item(index, path, e)
+
+
+def _item_path(item: BatchInput) -> Optional[str]:
+    if isinstance(item, Mat):
+        return None
+    try:
+        return os.fspath(item)
+    except TypeError:
+        return None
+
+
+def _error_item(
+    index: int, path: Optional[str], e: BaseException
+) -> DeviceOcrBatchItem:
+    error = "".join(traceback.format_exception_only(type(e), e))
+    return DeviceOcrBatchItem(
+        index=index,
+        path=path,
+        error=error.strip(),
+        traceback="".join(traceback.format_exception(type(e), e, e.__traceback__)),
+    )
+
+
+_worker: Optional[_Worker] = None
+
+
+def _init_worker(config: _WorkerConfig):
+    global _worker  # pylint: disable=global-statement
+    _worker = _Worker(config)
+
+
+def _run_worker(index: int, item: BatchInput) -> DeviceOcrBatchItem:
+    return _worker.run(index, item)
+
+
+class _PendingItem(NamedTuple):
+    index: int
+    path: Optional[str]
+    future: Future
+
+
+class _WorkerPool:
+    """A process pool of `_Worker`s that remembers if any item completed."""
+
+    def __init__(self, config: _WorkerConfig, max_workers: int):
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker, initargs=(config,)
+        )
+        self.completed = False
+
+    def submit(self, index: int, item: BatchInput) -> _PendingItem:
+        future = self.executor.submit(_run_worker, index, item)
+        future.add_done_callback(self._on_done)
+        return _PendingItem(index, _item_path(item), future)
+
+    def _on_done(self, future: Future):
+        if not future.cancelled() and future.exception() is None:
+            self.completed = True
+
+
+def _run_worker_batch(imgs: List[Mat]) -> List[Union[DeviceOcrResult, Exception]]:
+    return _worker.ocr_batch(imgs)
+
+
+class DeviceOcrBatchRunner:
+    """
+    A callable that recognizes a list of BGR screenshots with
+    `DeviceOcr.ocr_batch`, returning a result or an exception per image. Used
+    as the batch function of `AsyncOcr`.
+
+    By default batches run in the calling thread, and the KNN model and the
+    phash database are loaded on first call. With `max_workers`, the runner
+    owns a process pool whose workers load them once at start, pass file paths
+    (or a `SharedPhashDatabaseDescriptor`) then. `close` shuts the pool down
+    or drops the loaded models.
+    """
+
+    def __init__(
+        self,
+        knn_model: KnnModelSource,
+        phash_db: PhashDatabaseSource,
+        *,
+        max_workers: Optional[int] = None,
+        rois_type: Callable[[int, int], DeviceRois] = DeviceRoisAutoT2,
+        masker: DeviceRoisMasker = DeviceRoisMaskerAutoT2(),
+        **device_ocr_kwargs,
+    ):
+        """
+        :param max_workers: run batches in a process pool of this size. The
+            pool spawns its workers, so `rois_type`, `masker` and
+            `device_ocr_kwargs` must be importable or picklable.
+        """
+        self.config = _WorkerConfig(
+            knn_model=knn_model,
+            phash_db=phash_db,
+            rois_type=rois_type,
+            masker=masker,
+            device_ocr_kwargs=device_ocr_kwargs,
+        )
+        self.executor: Optional[ProcessPoolExecutor] = None
+        if max_workers is not None:
+            # called from `AsyncOcr` threads, forking could deadlock
+            self.executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.config,),
+            )
+        self._worker: Optional[_Worker] = None
+        self._worker_lock = threading.Lock()
+
+    def worker(self) -> _Worker:
+        """The worker of the calling process, loaded on first use."""
+        worker = self._worker
+        if worker is None:
+            with self._worker_lock:
+                worker = self._worker
+                if worker is None:
+                    worker = self._worker = _Worker(self.config)
+        return worker
+
+    def __call__(self, imgs: List[Mat]) -> List[Union[DeviceOcrResult, Exception]]:
+        if self.executor is not None:
+            return self.executor.submit(_run_worker_batch, imgs).result()
+        return self.worker().ocr_batch(imgs)
+
+    def __getstate__(self):
+        # a copy would load the models again in every process it is sent to
+        raise TypeError(
+            f"{type(self).__name__} cannot be pickled, "
+            "pass max_workers to run it in processes"
+        )
+
+    def close(self):
+        """Shut the process pool down and drop the loaded models."""
+        if self.executor is not None:
+            self.executor.shutdown()
+        self._worker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def ocr_device_batch(
+    items: Iterable[BatchInput],
+    knn_model_path: str,
+    phash_db: Union[str, SharedPhashDatabaseDescriptor],
+    *,
+    rois_type: Callable[[int, int], DeviceRois] = DeviceRoisAutoT2,
+    masker: DeviceRoisMasker = DeviceRoisMaskerAutoT2(),
+    ordered: bool = True,
+    max_workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    **device_ocr_kwargs,
+) -> Iterator[DeviceOcrBatchItem]:
+    """
+    Run `DeviceOcr.ocr` on many screenshots in a process pool, streaming the
+    results.
+
+    Every worker loads the KNN model and the phash database once. Errors are
+    captured per item in `DeviceOcrBatchItem.error`, the batch goes on. If a
+    worker process dies, the items in flight fail and the pool is restarted,
+    unless it never completed an item (e.g. the models failed to load), then
+    the remaining items fail without being run.
+
+    :param items: image paths, or BGR images which are pickled to the workers
+    :param knn_model_path: a model saved by `cv2.ml.KNearest.save`
+    :param phash_db: a database path, or the descriptor of a
+        `SharedImagePhashDatabase` to share one copy between the workers
+    :param rois_type: builds the `DeviceRois` from the image width and height
+    :param ordered: yield in input order, otherwise as completed
+    :param max_workers: process pool size, `None` for `os.cpu_count()`. With a
+        single worker, images are recognized in the current process.
+    :param max_pending: the number of submitted but not yet yielded items,
+        `max_workers * 4` by default, so that `items` can be a long lazy
+        iterable
+    :param device_ocr_kwargs: passed to `DeviceOcr`, must be picklable
+    """
+    config = _WorkerConfig(
+        knn_model=os.fspath(knn_model_path),
+        phash_db=phash_db
+        if isinstance(phash_db, SharedPhashDatabaseDescriptor)
+        else os.fspath(phash_db),
+        rois_type=rois_type,
+        masker=masker,
+        device_ocr_kwargs=device_ocr_kwargs,
+    )
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        worker = _Worker(config)
+        for index, item in enumerate(items):
+            yield worker.run(index, item)
+        return
+
+    max_pending = max(max_pending or max_workers * 4, 1)
+    pool: Optional[_WorkerPool] = _WorkerPool(config, max_workers)
+    broken: Optional[BrokenProcessPool] = None
+    pending: Deque[_PendingItem] = deque()
+    try:
+        for index, item in enumerate(items):
+            if pool is None:
+                yield _error_item(index, _item_path(item), broken)
+                continue
+
+            try:
+                pending.append(pool.submit(index, item))
+            except BrokenProcessPool as e:
+                # a worker died, the items it had are reported as failed
+                pool.executor.shutdown(wait=False)
+                if pool.completed:
+                    pool = _WorkerPool(config, max_workers)
+                    pending.append(pool.submit(index, item))
+                else:
+                    # the workers cannot even start, do not try again
+                    pool, broken = None, e
+                    yield _error_item(index, _item_path(item), e)
+
+            while len(pending) >= max_pending:
+                yield from _collect(pending, ordered)
+        while pending:
+            yield from _collect(pending, ordered)
+    finally:
+        for pending_item in pending:
+            pending_item.future.cancel()
+        if pool is not None:
+            pool.executor.shutdown()
+
+
+def _collect(
+    pending: Deque[_PendingItem], ordered: bool
+) -> Iterator[DeviceOcrBatchItem]:
+    """
+    Wait for the next finished items, remove them from `pending` and yield.
+    Errors outside of `_Worker.run`, like a crashed worker process, are
+    reported as failed items.
+    """
+    if ordered:
+        done = [pending.popleft()]
+    else:
+        done_futures, _ = wait([p.future for p in pending], return_when=FIRST_COMPLETED)
+        done = [p for p in pending if p.future in done_futures]
+        for pending_item in done:
+            pending.remove(pending_item)
+
+    for pending_item in sorted(done, key=lambda p: p.index):
+        try:
+            yield pending_item.future.result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            yield _error_item(pending_item.index, pending_item.path, e)
@@ -16,3 +16,8 @@ class DeviceOcrResult:
     clear_status: Optional[int] = None
     partner_id: Optional[str] = None
     partner_id_possibility: Optional[float] = None
+    pure_confidence: Optional[float] = None
+    far_confidence: Optional[float] = None
+    lost_confidence: Optional[float] = None
+    score_confidence: Optional[float] = None
+    max_recall_confidence: Optional[float] = None
@@ -1,13 +1,20 @@
+from concurrent.futures import Executor
+from typing import List, Optional, Sequence, Tuple
+
 import cv2
 import numpy as np
 
-from ..crop import crop_xywh
 from ..ocr import (
+    ConnectedComponents,
     FixRects,
+    KnnDigitResults,
+    KnnGlyphMemo,
+    knn_classify_digits_batch,
+    normalize_digits,
     ocr_digit_samples_knn,
-    ocr_digits_by_contour_knn,
+    ocr_digits_by_components_get_digits,
+    ocr_digits_by_contour_get_digits,
     preprocess_hog,
-    resize_fill_square,
 )
 from ..phash_db import ImagePhashDatabase
 from ..types import Mat
@@ -23,23 +30,33 @@ class DeviceOcr:
         masker: DeviceRoisMasker,
         knn_model: cv2.ml.KNearest,
         phash_db: ImagePhashDatabase,
+        *,
+        use_connected_components: bool = False,
+        glyph_memo: Optional[KnnGlyphMemo] = None,
     ):
+        """
+        :param use_connected_components: segment digits with
+            `ConnectedComponents` instead of `cv2.findContours`. Faster, but
+            blobs nested in other blobs and the pixel-count noise threshold
+            can give different results on borderline captures.
+        :param glyph_memo: a `KnnGlyphMemo` of `knn_model` and `k=4` that
+            `digit_fields` and `ocr` classify through, usually shared between
+            instances
+        """
         self.extractor = extractor
         self.masker = masker
         self.knn_model = knn_model
         self.phash_db = phash_db
+        self.use_connected_components = use_connected_components
+        self.glyph_memo = glyph_memo
 
-    def pfl(self, roi_gray: Mat, factor: float = 1.25):
+    @staticmethod
+    def pfl_segment_contours(roi_gray: Mat, factor: float = 1.25):
         contours, _ = cv2.findContours(
             roi_gray, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
         )
         filtered_contours = [c for c in contours if cv2.contourArea(c) >= 5 * factor]
         rects = [cv2.boundingRect(c) for c in filtered_contours]
-        rects = FixRects.connect_broken(rects, roi_gray.shape[1], roi_gray.shape[0])
-
-        filtered_rects = [r for r in rects if r[2] >= 5 * factor and r[3] >= 6 * factor]
-        filtered_rects = FixRects.split_connected(roi_gray, filtered_rects)
-        filtered_rects = sorted(filtered_rects, key=lambda r: r[0])
 
         roi_ocr = roi_gray.copy()
         filtered_contours_flattened = {tuple(c.flatten()) for c in filtered_contours}
@@ -47,62 +64,139 @@ class DeviceOcr:
             if tuple(contour.flatten()) in filtered_contours_flattened:
                 continue
             roi_ocr = cv2.fillPoly(roi_ocr, [contour], [0])
-        digit_rois = [
-            resize_fill_square(crop_xywh(roi_ocr, r), 20) for r in filtered_rects
-        ]
+        return rects, roi_ocr
+
+    @staticmethod
+    def pfl_segment_components(roi_gray: Mat, factor: float = 1.25):
+        components = ConnectedComponents.from_image(roi_gray)
+        components = components.select(components.areas >= 5 * factor)
+        return components.rect_tuples(), components.erase_others(roi_gray)
+
+    def pfl_digits(self, roi_gray: Mat, factor: float = 1.25):
+        if self.use_connected_components:
+            rects, roi_ocr = self.pfl_segment_components(roi_gray, factor)
+        else:
+            rects, roi_ocr = self.pfl_segment_contours(roi_gray, factor)
+        rects = FixRects.connect_broken(rects, roi_gray.shape[1], roi_gray.shape[0])
+
+        filtered_rects = [r for r in rects if r[2] >= 5 * factor and r[3] >= 6 * factor]
+        filtered_rects = FixRects.split_connected(roi_gray, filtered_rects)
+        filtered_rects = sorted(filtered_rects, key=lambda r: r[0])
+
+        return normalize_digits(roi_ocr, filtered_rects, 20)
+
+    def pfl_samples(self, roi_gray: Mat, factor: float = 1.25):
+        return preprocess_hog(self.pfl_digits(roi_gray, factor))
+
+    def pfl(self, roi_gray: Mat, factor: float = 1.25):
+        return ocr_digit_samples_knn(self.pfl_samples(roi_gray, factor), self.knn_model)
+
+    def pure_digits(self):
+        return self.pfl_digits(self.masker.pure(self.extractor.pure))
 
-        samples = preprocess_hog(digit_rois)
-        return ocr_digit_samples_knn(samples, self.knn_model)
+    def pure_samples(self):
+        return preprocess_hog(self.pure_digits())
 
     def pure(self):
-        return self.pfl(self.masker.pure(self.extractor.pure))
+        return ocr_digit_samples_knn(self.pure_samples(), self.knn_model)
+
+    def far_digits(self):
+        return self.pfl_digits(self.masker.far(self.extractor.far))
+
+    def far_samples(self):
+        return preprocess_hog(self.far_digits())
 
     def far(self):
-        return self.pfl(self.masker.far(self.extractor.far))
+        return ocr_digit_samples_knn(self.far_samples(), self.knn_model)
+
+    def lost_digits(self):
+        return self.pfl_digits(self.masker.lost(self.extractor.lost))
+
+    def lost_samples(self):
+        return preprocess_hog(self.lost_digits())
 
     def lost(self):
-        return self.pfl(self.masker.lost(self.extractor.lost))
+        return ocr_digit_samples_knn(self.lost_samples(), self.knn_model)
 
-    def score(self):
+    def score_digits(self):
         roi = self.masker.score(self.extractor.score)
+        if self.use_connected_components:
+            components = ConnectedComponents.from_image(roi)
+            # h >= score_component_h * 0.6
+            components = components.select(components.rects[:, 3] >= roi.shape[0] * 0.6)
+            return ocr_digits_by_components_get_digits(
+                components.erase_others(roi), 20, components
+            )
+
         contours, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
         for contour in contours:
             if (
                 cv2.boundingRect(contour)[3] < roi.shape[0] * 0.6
             ):  # h < score_component_h * 0.6
                 roi = cv2.fillPoly(roi, [contour], [0])
-        return ocr_digits_by_contour_knn(roi, self.knn_model)
+        return ocr_digits_by_contour_get_digits(roi, 20)
+
+    def score_samples(self):
+        return preprocess_hog(self.score_digits())
+
+    def score(self):
+        return ocr_digit_samples_knn(self.score_samples(), self.knn_model)
 
     def rating_class(self):
-        roi = self.extractor.rating_class
-        results = [
-            self.masker.rating_class_pst(roi),
-            self.masker.rating_class_prs(roi),
-            self.masker.rating_class_ftr(roi),
-            self.masker.rating_class_byd(roi),
-            self.masker.rating_class_etr(roi),
-        ]
-        return max(enumerate(results), key=lambda i: np.count_nonzero(i[1]))[0]
+        results = self.masker.rating_class_counts(self.extractor.rating_class)
+        return max(enumerate(results), key=lambda i: i[1])[0]
+
+    def max_recall_digits(self):
+        roi = self.masker.max_recall(self.extractor.max_recall)
+        if self.use_connected_components:
+            return ocr_digits_by_components_get_digits(roi, 20)
+        return ocr_digits_by_contour_get_digits(roi, 20)
+
+    def max_recall_samples(self):
+        return preprocess_hog(self.max_recall_digits())
 
     def max_recall(self):
-        return ocr_digits_by_contour_knn(
-            self.masker.max_recall(self.extractor.max_recall), self.knn_model
+        return ocr_digit_samples_knn(self.max_recall_samples(), self.knn_model)
+
+    def digit_fields_results(self) -> List[KnnDigitResults]:
+        """
+        The `KnnDigitResults` of pure, far, lost, score and max_recall, with
+        the digits of all five fields classified in a single `findNearest`
+        call, or through `glyph_memo`.
+        """
+        return self.classify_digit_fields(
+            [
+                self.pure_digits(),
+                self.far_digits(),
+                self.lost_digits(),
+                self.score_digits(),
+                self.max_recall_digits(),
+            ]
+        )
+
+    def classify_digit_fields(
+        self, digits_list: List[np.ndarray]
+    ) -> List[KnnDigitResults]:
+        return knn_classify_digits_batch(
+            digits_list, self.knn_model, memo=self.glyph_memo
+        )
+
+    def digit_fields(self) -> Tuple[int, int, int, int, int]:
+        """`(pure, far, lost, score, max_recall)`, see `digit_fields_results`."""
+        pure, far, lost, score, max_recall = (
+            results.value() for results in self.digit_fields_results()
         )
+        return pure, far, lost, score, max_recall
 
     def clear_status(self):
-        roi = self.extractor.clear_status
-        results = [
-            self.masker.clear_status_track_lost(roi),
-            self.masker.clear_status_track_complete(roi),
-            self.masker.clear_status_full_recall(roi),
-            self.masker.clear_status_pure_memory(roi),
-        ]
-        return max(enumerate(results), key=lambda i: np.count_nonzero(i[1]))[0]
+        results = self.masker.clear_status_counts(self.extractor.clear_status)
+        return max(enumerate(results), key=lambda i: i[1])[0]
+
+    def jacket_gray(self):
+        return cv2.cvtColor(self.extractor.jacket, cv2.COLOR_BGR2GRAY)
 
     def lookup_song_id(self):
-        return self.phash_db.lookup_jacket(
-            cv2.cvtColor(self.extractor.jacket, cv2.COLOR_BGR2GRAY)
-        )
+        return self.phash_db.lookup_jacket(self.jacket_gray())
 
     def song_id(self):
         return self.lookup_song_id()[0]
@@ -124,39 +218,144 @@ class DeviceOcr:
         )
         return img
 
-    def lookup_partner_id(self):
-        return self.phash_db.lookup_partner_icon(
-            self.preprocess_char_icon(
-                cv2.cvtColor(self.extractor.partner_icon, cv2.COLOR_BGR2GRAY)
-            )
+    def partner_icon_gray(self):
+        return self.preprocess_char_icon(
+            cv2.cvtColor(self.extractor.partner_icon, cv2.COLOR_BGR2GRAY)
         )
 
+    def lookup_partner_id(self):
+        return self.phash_db.lookup_partner_icon(self.partner_icon_gray())
+
     def partner_id(self):
         return self.lookup_partner_id()[0]
 
-    def ocr(self) -> DeviceOcrResult:
-        rating_class = self.rating_class()
-        pure = self.pure()
-        far = self.far()
-        lost = self.lost()
-        score = self.score()
-        max_recall = self.max_recall()
-        clear_status = self.clear_status()
+    def ocr(self, *, executor: Optional[Executor] = None) -> DeviceOcrResult:
+        """
+        :param executor: evaluate the independent fields concurrently on this
+            executor, usually a `ThreadPoolExecutor` shared between calls,
+            whose `max_workers` sets the parallelism. The digits of all fields
+            are still classified in one batch in the calling thread, and the
+            result is the same as without an executor.
+        """
+        tasks = [
+            self.rating_class,
+            self.pure_digits,
+            self.far_digits,
+            self.lost_digits,
+            self.score_digits,
+            self.max_recall_digits,
+            self.clear_status,
+            self.lookup_song_id,
+            self.lookup_partner_id,
+        ]
+        if executor is None:
+            results = [task() for task in tasks]
+        else:
+            futures = [executor.submit(task) for task in tasks]
+            try:
+                # in task order, so that errors are raised like in sequence
+                results = [future.result() for future in futures]
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        (
+            rating_class,
+            *digits_list,
+            clear_status,
+            song_id_result,
+            partner_id_result,
+        ) = results
+        return self.build_result(
+            rating_class,
+            self.classify_digit_fields(digits_list),
+            clear_status,
+            song_id_result,
+            partner_id_result,
+        )
 
+    def build_result(
+        self,
+        rating_class: int,
+        digit_fields_results: List[KnnDigitResults],
+        clear_status: int,
+        song_id_result: Tuple[str, int],
+        partner_id_result: Tuple[str, int],
+    ) -> DeviceOcrResult:
+        pure, far, lost, score, max_recall = digit_fields_results
         hash_len = self.phash_db.hash_size**2
-        song_id, song_id_distance = self.lookup_song_id()
-        partner_id, partner_id_distance = self.lookup_partner_id()
+        song_id, song_id_distance = song_id_result
+        partner_id, partner_id_distance = partner_id_result
 
         return DeviceOcrResult(
             rating_class=rating_class,
-            pure=pure,
-            far=far,
-            lost=lost,
-            score=score,
-            max_recall=max_recall,
+            pure=pure.value(),
+            far=far.value(),
+            lost=lost.value(),
+            score=score.value(),
+            max_recall=max_recall.value(),
             song_id=song_id,
             song_id_possibility=1 - song_id_distance / hash_len,
             clear_status=clear_status,
             partner_id=partner_id,
             partner_id_possibility=1 - partner_id_distance / hash_len,
+            pure_confidence=pure.confidence(),
+            far_confidence=far.confidence(),
+            lost_confidence=lost.confidence(),
+            score_confidence=score.confidence(),
+            max_recall_confidence=max_recall.confidence(),
         )
+
+    @staticmethod
+    def ocr_batch(ocrs: Sequence["DeviceOcr"]) -> List[DeviceOcrResult]:
+        """
+        `ocr` of several screenshots at once. The digits of all screenshots
+        are classified in one batch, and the jackets and partner icons are
+        looked up in one batch each.
+
+        All `ocrs` must share the KNN model, the glyph memo and the phash
+        database.
+        """
+        if not ocrs:
+            return []
+        first = ocrs[0]
+        if any(
+            ocr.knn_model is not first.knn_model
+            or ocr.glyph_memo is not first.glyph_memo
+            or ocr.phash_db is not first.phash_db
+            for ocr in ocrs
+        ):
+            raise ValueError(
+                "All DeviceOcr of a batch must share the KNN model, "
+                "the glyph memo and the phash database"
+            )
+
+        digits_list = []
+        for ocr in ocrs:
+            digits_list.extend(
+                [
+                    ocr.pure_digits(),
+                    ocr.far_digits(),
+                    ocr.lost_digits(),
+                    ocr.score_digits(),
+                    ocr.max_recall_digits(),
+                ]
+            )
+        digit_fields_results = first.classify_digit_fields(digits_list)
+        song_id_results = first.phash_db.lookup_jackets_batch(
+            [ocr.jacket_gray() for ocr in ocrs], limit=1
+        )
+        partner_id_results = first.phash_db.lookup_partner_icons_batch(
+            [ocr.partner_icon_gray() for ocr in ocrs], limit=1
+        )
+
+        return [
+            ocr.build_result(
+                ocr.rating_class(),
+                digit_fields_results[i * 5 : i * 5 + 5],
+                ocr.clear_status(),
+                song_id_results[i][0],
+                partner_id_results[i][0],
+            )
+            for i, ocr in enumerate(ocrs)
+        ]
@@ -1,6 +1,9 @@
+from typing import List, Optional, Sequence
+
 import cv2
 import numpy as np
 
+from ....color import HsvRangeClassifier
 from ....types import Mat
 from .common import DeviceRoisMasker
 
@@ -8,11 +11,80 @@ from .common import DeviceRoisMasker
 class DeviceRoisMaskerAuto(DeviceRoisMasker):
     # pylint: disable=abstract-method
 
+    RATING_CLASS_HSV_RANGES = ["PST", "PRS", "FTR", "BYD", "ETR"]
+    CLEAR_STATUS_HSV_RANGES = [
+        "TRACK_LOST",
+        "TRACK_COMPLETE",
+        "FULL_RECALL",
+        "PURE_MEMORY",
+    ]
+
+    @classmethod
+    def hsv_classifier(cls, names: Sequence[str]) -> HsvRangeClassifier:
+        """
+        The `HsvRangeClassifier` of the `{name}_HSV_MIN` and `{name}_HSV_MAX`
+        constants of this class, built on first use.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        classifiers = cls.__dict__.get("_hsv_classifiers")
+        if classifiers is None:
+            classifiers = cls._hsv_classifiers = {}
+        key = tuple(names)
+        classifier = classifiers.get(key)
+        if classifier is None:
+            classifier = classifiers[key] = HsvRangeClassifier(
+                [
+                    (getattr(cls, f"{name}_HSV_MIN"), getattr(cls, f"{name}_HSV_MAX"))
+                    for name in names
+                ]
+            )
+        return classifier
+
     @staticmethod
-    def mask_bgr_in_hsv(roi_bgr: Mat, hsv_lower: Mat, hsv_upper: Mat):
-        return cv2.inRange(
-            cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2HSV), hsv_lower, hsv_upper
-        )
+    def mask_bgr_in_hsv(
+        roi_bgr: Mat,
+        hsv_lower: Mat,
+        hsv_upper: Mat,
+        roi_hsv: Optional[Mat] = None,
+    ):
+        """
+        :param roi_hsv: `roi_bgr` already converted to HSV, to share one
+            conversion between several masks of the same ROI
+        """
+        if roi_hsv is None:
+            roi_hsv = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2HSV)
+        return cv2.inRange(roi_hsv, hsv_lower, hsv_upper)
+
+    @classmethod
+    def rating_class_masks(cls, roi_bgr: Mat) -> List[Mat]:
+        roi_hsv = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2HSV)
+        return [
+            cls.rating_class_pst(roi_bgr, roi_hsv=roi_hsv),
+            cls.rating_class_prs(roi_bgr, roi_hsv=roi_hsv),
+            cls.rating_class_ftr(roi_bgr, roi_hsv=roi_hsv),
+            cls.rating_class_byd(roi_bgr, roi_hsv=roi_hsv),
+            cls.rating_class_etr(roi_bgr, roi_hsv=roi_hsv),
+        ]
+
+    @classmethod
+    def clear_status_masks(cls, roi_bgr: Mat) -> List[Mat]:
+        roi_hsv = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2HSV)
+        return [
+            cls.clear_status_track_lost(roi_bgr, roi_hsv=roi_hsv),
+            cls.clear_status_track_complete(roi_bgr, roi_hsv=roi_hsv),
+            cls.clear_status_full_recall(roi_bgr, roi_hsv=roi_hsv),
+            cls.clear_status_pure_memory(roi_bgr, roi_hsv=roi_hsv),
+        ]
+
+    @classmethod
+    def rating_class_counts(cls, roi_bgr: Mat) -> List[int]:
+        classifier = cls.hsv_classifier(cls.RATING_CLASS_HSV_RANGES)
+        return classifier.counts_bgr(roi_bgr)
+
+    @classmethod
+    def clear_status_counts(cls, roi_bgr: Mat) -> List[int]:
+        classifier = cls.hsv_classifier(cls.CLEAR_STATUS_HSV_RANGES)
+        return classifier.counts_bgr(roi_bgr)
 
 
 class DeviceRoisMaskerAutoT1(DeviceRoisMaskerAuto):
@@ -71,55 +143,78 @@ class DeviceRoisMaskerAutoT1(DeviceRoisMaskerAuto):
         return cls.gray(roi_bgr)
 
     @classmethod
-    def score(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.SCORE_HSV_MIN, cls.SCORE_HSV_MAX)
+    def score(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.SCORE_HSV_MIN, cls.SCORE_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_pst(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.PST_HSV_MIN, cls.PST_HSV_MAX)
+    def rating_class_pst(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.PST_HSV_MIN, cls.PST_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_prs(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.PRS_HSV_MIN, cls.PRS_HSV_MAX)
+    def rating_class_prs(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.PRS_HSV_MIN, cls.PRS_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_ftr(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.FTR_HSV_MIN, cls.FTR_HSV_MAX)
+    def rating_class_ftr(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.FTR_HSV_MIN, cls.FTR_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_byd(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.BYD_HSV_MIN, cls.BYD_HSV_MAX)
+    def rating_class_byd(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.BYD_HSV_MIN, cls.BYD_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_etr(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.ETR_HSV_MIN, cls.ETR_HSV_MAX)
+    def rating_class_etr(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.ETR_HSV_MIN, cls.ETR_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
     def max_recall(cls, roi_bgr: Mat) -> Mat:
         return cls.gray(roi_bgr)
 
     @classmethod
-    def clear_status_track_lost(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_track_lost(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.TRACK_LOST_HSV_MIN, cls.TRACK_LOST_HSV_MAX
+            roi_bgr, cls.TRACK_LOST_HSV_MIN, cls.TRACK_LOST_HSV_MAX, roi_hsv=roi_hsv
         )
 
     @classmethod
-    def clear_status_track_complete(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_track_complete(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.TRACK_COMPLETE_HSV_MIN, cls.TRACK_COMPLETE_HSV_MAX
+            roi_bgr,
+            cls.TRACK_COMPLETE_HSV_MIN,
+            cls.TRACK_COMPLETE_HSV_MAX,
+            roi_hsv=roi_hsv,
         )
 
     @classmethod
-    def clear_status_full_recall(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_full_recall(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.FULL_RECALL_HSV_MIN, cls.FULL_RECALL_HSV_MAX
+            roi_bgr, cls.FULL_RECALL_HSV_MIN, cls.FULL_RECALL_HSV_MAX, roi_hsv=roi_hsv
         )
 
     @classmethod
-    def clear_status_pure_memory(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_pure_memory(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.PURE_MEMORY_HSV_MIN, cls.PURE_MEMORY_HSV_MAX
+            roi_bgr, cls.PURE_MEMORY_HSV_MIN, cls.PURE_MEMORY_HSV_MAX, roi_hsv=roi_hsv
         )
 
 
@@ -161,8 +256,10 @@ class DeviceRoisMaskerAutoT2(DeviceRoisMaskerAuto):
     PURE_MEMORY_HSV_MAX = np.array([110, 200, 175], np.uint8)
 
     @classmethod
-    def pfl(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.PFL_HSV_MIN, cls.PFL_HSV_MAX)
+    def pfl(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.PFL_HSV_MIN, cls.PFL_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
     def pure(cls, roi_bgr: Mat) -> Mat:
@@ -177,55 +274,78 @@ class DeviceRoisMaskerAutoT2(DeviceRoisMaskerAuto):
         return cls.pfl(roi_bgr)
 
     @classmethod
-    def score(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.SCORE_HSV_MIN, cls.SCORE_HSV_MAX)
+    def score(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.SCORE_HSV_MIN, cls.SCORE_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_pst(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.PST_HSV_MIN, cls.PST_HSV_MAX)
+    def rating_class_pst(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.PST_HSV_MIN, cls.PST_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_prs(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.PRS_HSV_MIN, cls.PRS_HSV_MAX)
+    def rating_class_prs(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.PRS_HSV_MIN, cls.PRS_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_ftr(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.FTR_HSV_MIN, cls.FTR_HSV_MAX)
+    def rating_class_ftr(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.FTR_HSV_MIN, cls.FTR_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_byd(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.BYD_HSV_MIN, cls.BYD_HSV_MAX)
+    def rating_class_byd(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.BYD_HSV_MIN, cls.BYD_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def rating_class_etr(cls, roi_bgr: Mat) -> Mat:
-        return cls.mask_bgr_in_hsv(roi_bgr, cls.ETR_HSV_MIN, cls.ETR_HSV_MAX)
+    def rating_class_etr(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
+        return cls.mask_bgr_in_hsv(
+            roi_bgr, cls.ETR_HSV_MIN, cls.ETR_HSV_MAX, roi_hsv=roi_hsv
+        )
 
     @classmethod
-    def max_recall(cls, roi_bgr: Mat) -> Mat:
+    def max_recall(cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.MAX_RECALL_HSV_MIN, cls.MAX_RECALL_HSV_MAX
+            roi_bgr, cls.MAX_RECALL_HSV_MIN, cls.MAX_RECALL_HSV_MAX, roi_hsv=roi_hsv
         )
 
     @classmethod
-    def clear_status_track_lost(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_track_lost(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.TRACK_LOST_HSV_MIN, cls.TRACK_LOST_HSV_MAX
+            roi_bgr, cls.TRACK_LOST_HSV_MIN, cls.TRACK_LOST_HSV_MAX, roi_hsv=roi_hsv
         )
 
     @classmethod
-    def clear_status_track_complete(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_track_complete(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.TRACK_COMPLETE_HSV_MIN, cls.TRACK_COMPLETE_HSV_MAX
+            roi_bgr,
+            cls.TRACK_COMPLETE_HSV_MIN,
+            cls.TRACK_COMPLETE_HSV_MAX,
+            roi_hsv=roi_hsv,
         )
 
     @classmethod
-    def clear_status_full_recall(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_full_recall(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.FULL_RECALL_HSV_MIN, cls.FULL_RECALL_HSV_MAX
+            roi_bgr, cls.FULL_RECALL_HSV_MIN, cls.FULL_RECALL_HSV_MAX, roi_hsv=roi_hsv
         )
 
     @classmethod
-    def clear_status_pure_memory(cls, roi_bgr: Mat) -> Mat:
+    def clear_status_pure_memory(
+        cls, roi_bgr: Mat, roi_hsv: Optional[Mat] = None
+    ) -> Mat:
         return cls.mask_bgr_in_hsv(
-            roi_bgr, cls.PURE_MEMORY_HSV_MIN, cls.PURE_MEMORY_HSV_MAX
+            roi_bgr, cls.PURE_MEMORY_HSV_MIN, cls.PURE_MEMORY_HSV_MAX, roi_hsv=roi_hsv
         )
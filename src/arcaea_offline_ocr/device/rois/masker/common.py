@@ -1,3 +1,7 @@
+from typing import List
+
+import numpy as np
+
 from ....types import Mat
 
 
@@ -57,3 +61,37 @@ class DeviceRoisMasker:
     @classmethod
     def clear_status_pure_memory(cls, roi_bgr: Mat) -> Mat:
         raise NotImplementedError()
+
+    @classmethod
+    def rating_class_masks(cls, roi_bgr: Mat) -> List[Mat]:
+        """The pst, prs, ftr, byd and etr masks of the rating class ROI."""
+        return [
+            cls.rating_class_pst(roi_bgr),
+            cls.rating_class_prs(roi_bgr),
+            cls.rating_class_ftr(roi_bgr),
+            cls.rating_class_byd(roi_bgr),
+            cls.rating_class_etr(roi_bgr),
+        ]
+
+    @classmethod
+    def clear_status_masks(cls, roi_bgr: Mat) -> List[Mat]:
+        """
+        The track lost, track complete, full recall and pure memory masks of
+        the clear status ROI.
+        """
+        return [
+            cls.clear_status_track_lost(roi_bgr),
+            cls.clear_status_track_complete(roi_bgr),
+            cls.clear_status_full_recall(roi_bgr),
+            cls.clear_status_pure_memory(roi_bgr),
+        ]
+
+    @classmethod
+    def rating_class_counts(cls, roi_bgr: Mat) -> List[int]:
+        """The pixel counts of `rating_class_masks`."""
+        return [np.count_nonzero(mask) for mask in cls.rating_class_masks(roi_bgr)]
+
+    @classmethod
+    def clear_status_counts(cls, roi_bgr: Mat) -> List[int]:
+        """The pixel counts of `clear_status_masks`."""
+        return [np.count_nonzero(mask) for mask in cls.clear_status_masks(roi_bgr)]
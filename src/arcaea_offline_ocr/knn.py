@@ -0,0 +1,272 @@
+"""
+Tools to shrink trained `cv2.ml.KNearest` digit models.
+
+A `cv2.ml.KNearest` keeps every training sample, and `findNearest` scans all of
+them. The functions here pick a smaller set of training samples, retrain a
+plain `cv2.ml.KNearest` on it and measure the accuracy and latency on a
+held-out set. The compact model is saved and loaded like any other model, e.g.
+`model.save("knn.dat")` and `cv2.ml.KNearest.load("knn.dat")`.
+"""
+
+import time
+from typing import Optional, Tuple
+
+import attrs
+import cv2
+import numpy as np
+
+__all__ = [
+    "KnnModelReport",
+    "knn_model_train_data",
+    "train_knn_model",
+    "split_knn_samples",
+    "condensed_nearest_neighbour",
+    "class_prototypes",
+    "evaluate_knn_model",
+    "compact_knn_model",
+]
+
+
+@attrs.define
+class KnnModelReport:
+    train_size: int
+    accuracy: float
+    seconds_per_sample: float
+
+
+def knn_model_train_data(knn_model: cv2.ml.KNearest) -> Tuple[np.ndarray, np.ndarray]:
+    """The `(samples, responses)` a trained `cv2.ml.KNearest` holds."""
+    fs = cv2.FileStorage(
+        "",
+        cv2.FILE_STORAGE_WRITE | cv2.FILE_STORAGE_MEMORY | cv2.FILE_STORAGE_FORMAT_JSON,
+    )
+    knn_model.write(fs)
+    fs = cv2.FileStorage(
+        fs.releaseAndGetString(), cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY
+    )
+    samples = fs.getNode("samples").mat()
+    responses = fs.getNode("responses").mat()
+    fs.release()
+    if samples is None or responses is None:
+        raise ValueError("The KNN model is not trained")
+    return samples.astype(np.float32), responses.ravel().astype(np.float32)
+
+
+def train_knn_model(
+    samples: np.ndarray,
+    responses: np.ndarray,
+    *,
+    like: Optional[cv2.ml.KNearest] = None,
+) -> cv2.ml.KNearest:
+    """
+    :param like: copy the default k, classifier flag and algorithm type of
+        this model
+    """
+    knn_model = cv2.ml.KNearest_create()
+    if like is not None:
+        knn_model.setDefaultK(like.getDefaultK())
+        knn_model.setIsClassifier(like.getIsClassifier())
+        knn_model.setAlgorithmType(like.getAlgorithmType())
+    knn_model.train(
+        np.ascontiguousarray(samples, np.float32),
+        cv2.ml.ROW_SAMPLE,
+        np.ascontiguousarray(responses, np.float32).reshape(-1, 1),
+    )
+    return knn_model
+
+
+def split_knn_samples(
+    samples: np.ndarray,
+    responses: np.ndarray,
+    test_ratio: float = 0.2,
+    *,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Shuffle and split into `(train_samples, train_responses, test_samples,
+    test_responses)`, keeping the class ratios of both parts.
+    """
+    rng = np.random.default_rng(seed)
+    test_mask = np.zeros(len(responses), dtype=bool)
+    for label in np.unique(responses):
+        indices = rng.permutation(np.flatnonzero(responses == label))
+        test_mask[indices[: round(len(indices) * test_ratio)]] = True
+    return (
+        samples[~test_mask],
+        responses[~test_mask],
+        samples[test_mask],
+        responses[test_mask],
+    )
+
+
+def _majority_label(labels: np.ndarray):
+    """The most frequent label, the smallest one on ties, like `findNearest`."""
+    values, counts = np.unique(labels, return_counts=True)
+    return values[np.argmax(counts)]
+
+
+def condensed_nearest_neighbour(
+    samples: np.ndarray, responses: np.ndarray, *, k: int = 1, seed: int = 0
+) -> np.ndarray:
+    """
+    Hart's condensed nearest neighbour rule: the indices of a subset that
+    still classifies every other training sample correctly with a majority
+    vote of its `k` nearest neighbours, like `findNearest(samples, k)`.
+
+    Mostly drops samples deep inside their class and keeps the ones near class
+    borders. Pass the `k` the model is queried with, a subset condensed for
+    1-NN can be far less accurate with a larger `k`.
+    """
+    if k < 1:
+        raise ValueError("k must be greater than or equal to 1")
+
+    samples = np.asarray(samples, np.float32)
+    responses = np.asarray(responses).ravel()
+    order = np.random.default_rng(seed).permutation(len(responses))
+
+    store = np.empty_like(samples)
+    store_responses = np.empty_like(responses)
+    store_norms = np.empty(len(responses), np.float32)
+    in_store = np.zeros(len(responses), dtype=bool)
+    size = 0
+
+    def add(index):
+        nonlocal size
+        store[size] = samples[index]
+        store_responses[size] = responses[index]
+        store_norms[size] = samples[index] @ samples[index]
+        in_store[index] = True
+        size += 1
+
+    def classify(sample):
+        # squared distances without the constant |sample|^2 term
+        distances = store_norms[:size] - 2 * (store[:size] @ sample)
+        if k == 1:
+            return store_responses[np.argmin(distances)]
+        if size <= k:
+            return _majority_label(store_responses[:size])
+        nearest = np.argpartition(distances, k - 1)[:k]
+        return _majority_label(store_responses[nearest])
+
+    # start with one sample of every class
+    _, first_indices = np.unique(responses[order], return_index=True)
+    for index in order[np.sort(first_indices)]:
+        add(index)
+
+    changed = True
+    while changed:
+        changed = False
+        for index in order:
+            if in_store[index]:
+                continue
+            if classify(samples[index]) != responses[index]:
+                add(index)
+                changed = True
+
+    return np.flatnonzero(in_store)
+
+
+def class_prototypes(
+    samples: np.ndarray,
+    responses: np.ndarray,
+    per_class: int,
+    *,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Replace the samples of every class with at most `per_class` k-means
+    centers of that class.
+    """
+    samples = np.asarray(samples, np.float32)
+    responses = np.asarray(responses, np.float32).ravel()
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 1e-4)
+    cv2.setRNGSeed(seed)
+
+    prototypes = []
+    prototype_responses = []
+    for label in np.unique(responses):
+        class_samples = samples[responses == label]
+        if len(class_samples) <= per_class:
+            centers = class_samples
+        else:
+            _, _, centers = cv2.kmeans(
+                class_samples, per_class, None, criteria, 3, cv2.KMEANS_PP_CENTERS
+            )
+        prototypes.append(centers)
+        prototype_responses.append(np.full(len(centers), label, np.float32))
+    return np.concatenate(prototypes), np.concatenate(prototype_responses)
+
+
+def evaluate_knn_model(
+    knn_model: cv2.ml.KNearest,
+    samples: np.ndarray,
+    responses: np.ndarray,
+    *,
+    k: int = 4,
+    rounds: int = 3,
+) -> KnnModelReport:
+    """
+    Accuracy and `findNearest` latency of `knn_model` on a held-out set.
+    The latency is the best of `rounds` runs over the whole set.
+    """
+    samples = np.ascontiguousarray(samples, np.float32)
+    seconds = float("inf")
+    for _ in range(max(rounds, 1)):
+        start = time.perf_counter()
+        _, results, _, _ = knn_model.findNearest(samples, k)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    return KnnModelReport(
+        train_size=len(knn_model_train_data(knn_model)[0]),
+        accuracy=float(np.mean(results.ravel() == np.ravel(responses))),
+        seconds_per_sample=seconds / len(samples),
+    )
+
+
+def compact_knn_model(
+    knn_model: cv2.ml.KNearest,
+    test_samples: np.ndarray,
+    test_responses: np.ndarray,
+    *,
+    method: str = "condensed",
+    per_class: int = 50,
+    k: int = 4,
+    seed: int = 0,
+    max_accuracy_loss: Optional[float] = 0.01,
+) -> Tuple[cv2.ml.KNearest, KnnModelReport, KnnModelReport]:
+    """
+    Shrink a trained model and compare it against the original on a
+    held-out set that is not part of the model's training data.
+
+    :param method: `"condensed"` for `condensed_nearest_neighbour` with `k`,
+        or `"prototypes"` for `class_prototypes` with `per_class` centers
+    :param k: the `k` the model is queried with, 4 everywhere in this package
+    :param max_accuracy_loss: raise `ValueError` if the compact model's
+        held-out accuracy is lower than the original's by more than this,
+        `None` to always return the compact model
+    :return: `(compact_model, original_report, compact_report)`
+    """
+    samples, responses = knn_model_train_data(knn_model)
+    if method == "condensed":
+        indices = condensed_nearest_neighbour(samples, responses, k=k, seed=seed)
+        samples, responses = samples[indices], responses[indices]
+    elif method == "prototypes":
+        samples, responses = class_prototypes(samples, responses, per_class, seed=seed)
+    else:
+        raise ValueError(f"Unknown method {method!r}")
+
+    compact_model = train_knn_model(samples, responses, like=knn_model)
+    original_report = evaluate_knn_model(knn_model, test_samples, test_responses, k=k)
+    compact_report = evaluate_knn_model(
+        compact_model, test_samples, test_responses, k=k
+    )
+    if (
+        max_accuracy_loss is not None
+        and original_report.accuracy - compact_report.accuracy > max_accuracy_loss
+    ):
+        raise ValueError(
+            f"The {method} model's accuracy {compact_report.accuracy:.4f} is "
+            f"more than {max_accuracy_loss} below the original model's "
+            f"{original_report.accuracy:.4f}"
+        )
+    return compact_model, original_report, compact_report
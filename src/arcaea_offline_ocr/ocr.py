@@ -1,17 +1,33 @@
 import math
-from typing import Optional, Sequence, Tuple
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
 
+from .cache import CacheInfo, LruCache
 from .crop import crop_xywh
 from .types import Mat
 
 __all__ = [
     "FixRects",
+    "normalize_digits",
+    "HogFeatureExtractor",
     "preprocess_hog",
+    "KnnDigitResults",
+    "knn_classify_batch",
+    "knn_find_nearest_batch",
+    "ocr_digit_samples_knn_batch",
+    "KnnGlyphMemo",
+    "knn_classify_digits_batch",
+    "knn_find_nearest_digits_batch",
+    "ocr_digits_by_contour_get_digits",
     "ocr_digits_by_contour_get_samples",
     "ocr_digits_by_contour_knn",
+    "ConnectedComponents",
+    "ocr_digits_by_components_get_digits",
+    "ocr_digits_by_components_get_samples",
+    "ocr_digits_by_components_knn",
 ]
 
 
@@ -30,39 +46,45 @@ class FixRects:
         if tolerance is None:
             tolerance = math.ceil(img_width * 0.08)
 
+        rects = list(rects)
+        if not rects:
+            return []
+
+        rects_array = np.array(rects, dtype=np.int64).reshape(-1, 4)
+        x, y, w, h = rects_array.T
+        right = x + w
+        bottom = y + h
+        # rects are compared by value, equal rects are consumed together
+        _, value_ids = np.unique(rects_array, axis=0, return_inverse=True)
+        value_ids = value_ids.ravel()
+
+        # grab those small rects
+        candidates = np.flatnonzero((img_height * 0.1 <= h) & (h <= img_height * 0.6))
+        # see if there's other rects that have near left & right borders
+        near = (
+            (np.abs(x[candidates, None] - x) < tolerance)
+            & (np.abs(right[candidates, None] - right) < tolerance)
+            & (value_ids[candidates, None] != value_ids)
+        )
+
         new_rects = []
-        consumed_rects = []
-        for rect in rects:
-            if rect in consumed_rects:
+        consumed = np.zeros(value_ids.max() + 1, dtype=bool)
+        for candidate, group in zip(candidates, near):
+            if consumed[value_ids[candidate]] or not group.any():
                 continue
 
-            x, _, w, h = rect
-            # grab those small rects
-            if not img_height * 0.1 <= h <= img_height * 0.6:
-                continue
+            group[candidate] = True
+            consumed[value_ids[group]] = True
+            # calculate the new rect
+            new_x = int(x[group].min())
+            new_y = int(y[group].min())
+            new_w = int(right[group].max()) - new_x
+            new_h = int(bottom[group].max()) - new_y
+            new_rects.append((new_x, new_y, new_w, new_h))
 
-            group = []
-            # see if there's other rects that have near left & right borders
-            for other_rect in rects:
-                if rect == other_rect:
-                    continue
-                ox, _, ow, _ = other_rect
-                if abs(x - ox) < tolerance and abs((x + w) - (ox + ow)) < tolerance:
-                    group.append(other_rect)
-
-            if group:
-                group.append(rect)
-                consumed_rects.extend(group)
-                # calculate the new rect
-                new_x = min(r[0] for r in group)
-                new_y = min(r[1] for r in group)
-                new_right = max(r[0] + r[2] for r in group)
-                new_bottom = max(r[1] + r[3] for r in group)
-                new_w = new_right - new_x
-                new_h = new_bottom - new_y
-                new_rects.append((new_x, new_y, new_w, new_h))
-
-        return_rects = [r for r in rects if r not in consumed_rects]
+        return_rects = [
+            r for r, is_consumed in zip(rects, consumed[value_ids]) if not is_consumed
+        ]
         return_rects.extend(new_rects)
         return return_rects
 
@@ -73,38 +95,34 @@ class FixRects:
         rect_wh_ratio: float = 1.05,
         width_range_ratio: float = 0.1,
     ):
-        connected_rects = []
-        new_rects = []
-        for rect in rects:
-            rx, ry, rw, rh = rect
-            if rw / rh <= rect_wh_ratio:
-                continue
+        rects_list = list(rects)
+        if not rects_list:
+            return []
 
-            connected_rects.append(rect)
+        rects_array = np.array(rects_list, dtype=np.int64).reshape(-1, 4)
+        is_connected = rects_array[:, 2] / rects_array[:, 3] > rect_wh_ratio
 
+        new_rects = []
+        for rx, ry, rw, rh in rects_array[is_connected].tolist():
             # find the thinnest part
             border_ignore = round(rw * width_range_ratio)
             img_cropped = crop_xywh(
                 img_masked,
                 (border_ignore, ry, rw - border_ignore, rh),
             )
-            white_pixels = {}  # dict[x, white_pixel_number]
-            for i in range(img_cropped.shape[1]):
-                col = img_cropped[:, i]
-                white_pixels[rx + border_ignore + i] = np.count_nonzero(col > 200)
-
-            if all(v == 0 for v in white_pixels.values()):
+            white_pixels = np.count_nonzero(img_cropped > 200, axis=0)
+            if not white_pixels.any():
                 return rects
 
-            least_white_pixels = min(v for v in white_pixels.values() if v > 0)
-            x_values = [
-                x for x, pixel in white_pixels.items() if pixel == least_white_pixels
-            ]
+            least_white_pixels = white_pixels[white_pixels > 0].min()
+            x_values = (
+                rx + border_ignore + np.flatnonzero(white_pixels == least_white_pixels)
+            )
             # select only middle values
             x_mean = np.mean(x_values)
             x_std = np.std(x_values)
-            x_values = [
-                x for x in x_values if x_mean - x_std * 1.5 <= x <= x_mean + x_std * 1.5
+            x_values = x_values[
+                (x_mean - x_std * 1.5 <= x_values) & (x_values <= x_mean + x_std * 1.5)
             ]
             x_mid = round(np.median(x_values))
 
@@ -113,12 +131,18 @@ class FixRects:
                 [(rx, ry, x_mid - rx, rh), (x_mid, ry, rx + rw - x_mid, rh)]
             )
 
-        return_rects = [r for r in rects if r not in connected_rects]
+        return_rects = [
+            r for r, connected in zip(rects_list, is_connected) if not connected
+        ]
         return_rects.extend(new_rects)
         return return_rects
 
 
-def resize_fill_square(img: Mat, target: int = 20):
+def resize_fill_square_into(img: Mat, out: np.ndarray) -> np.ndarray:
+    """
+    `resize_fill_square` of a grayscale `img`, written into the square `out`.
+    """
+    target = out.shape[0]
     h, w = img.shape[:2]
     if h > w:
         new_h = target
@@ -129,6 +153,16 @@ def resize_fill_square(img: Mat, target: int = 20):
     resized = cv2.resize(img, (new_w, new_h))
 
     border_size = math.ceil((max(new_w, new_h) - min(new_w, new_h)) / 2)
+    if min(new_w, new_h) + border_size * 2 == target:
+        # the filled square is already `target` wide, resize it in place
+        out[...] = 0
+        if new_w < new_h:
+            out[:, border_size : border_size + new_w] = resized
+        else:
+            out[border_size : border_size + new_h, :] = resized
+        return out
+
+    # the filled square is one pixel too large and has to be scaled down
     if new_w < new_h:
         resized = cv2.copyMakeBorder(
             resized, 0, 0, border_size, border_size, cv2.BORDER_CONSTANT
@@ -137,27 +171,359 @@ def resize_fill_square(img: Mat, target: int = 20):
         resized = cv2.copyMakeBorder(
             resized, border_size, border_size, 0, 0, cv2.BORDER_CONSTANT
         )
-    return cv2.resize(resized, (target, target))
+    if out.flags.c_contiguous:
+        cv2.resize(resized, (target, target), dst=out)
+    else:
+        out[...] = cv2.resize(resized, (target, target))
+    return out
+
+
+def resize_fill_square(img: Mat, target: int = 20):
+    return resize_fill_square_into(img, np.empty((target, target), img.dtype))
+
+
+def normalize_digits(
+    img: Mat,
+    rects: Sequence[Tuple[int, int, int, int]],
+    size: int = 20,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Crop every rect of a grayscale `img` and `resize_fill_square` it into its
+    slot of one `(n, size, size)` batch, ready for `preprocess_hog`.
+
+    :param out: optional preallocated batch to write into
+    """
+    if out is None:
+        out = np.empty((len(rects), size, size), img.dtype)
+    elif out.shape != (len(rects), size, size):
+        raise ValueError(
+            f"out has shape {out.shape}, expected {(len(rects), size, size)}"
+        )
+
+    for digit, rect in zip(out, rects):
+        resize_fill_square_into(crop_xywh(img, rect), digit)
+    return out
+
+
+class HogFeatureExtractor:
+    """
+    Computes HOG features of digit images into one float32 matrix.
+
+    A `cv2.HOGDescriptor` is created once per thread and reused, so a single
+    extractor can be shared between threads.
+    """
+
+    def __init__(
+        self,
+        win_size: Tuple[int, int] = (20, 20),
+        block_size: Tuple[int, int] = (10, 10),
+        block_stride: Tuple[int, int] = (5, 5),
+        cell_size: Tuple[int, int] = (10, 10),
+        nbins: int = 9,
+    ):
+        self.win_size = win_size
+        self.block_size = block_size
+        self.block_stride = block_stride
+        self.cell_size = cell_size
+        self.nbins = nbins
+
+        self.__local = threading.local()
+        self.feature_size = self.descriptor.getDescriptorSize()
+
+    @property
+    def descriptor(self) -> cv2.HOGDescriptor:
+        """The `cv2.HOGDescriptor` of the current thread."""
+        descriptor = getattr(self.__local, "descriptor", None)
+        if descriptor is None:
+            descriptor = cv2.HOGDescriptor(
+                self.win_size,
+                self.block_size,
+                self.block_stride,
+                self.cell_size,
+                self.nbins,
+            )
+            self.__local.descriptor = descriptor
+        return descriptor
+
+    def compute(
+        self, digit_rois: Sequence[Mat], out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        :param digit_rois: grayscale images of `win_size`, or an array of shape
+            `(n, win_height, win_width)`
+        :param out: optional float32 array of shape `(n, feature_size)` to write
+            the features into
+        :return: float32 array of shape `(n, feature_size)`
+        """
+        if out is None:
+            out = np.empty((len(digit_rois), self.feature_size), np.float32)
+        elif out.shape != (len(digit_rois), self.feature_size):
+            raise ValueError(
+                f"out has shape {out.shape}, "
+                f"expected {(len(digit_rois), self.feature_size)}"
+            )
+
+        win_width, win_height = self.win_size
+        descriptor = self.descriptor
+        for i, digit in enumerate(digit_rois):
+            if digit.shape[:2] != (win_height, win_width):
+                raise ValueError(
+                    f"Digit {i} has shape {digit.shape[:2]}, "
+                    f"expected {(win_height, win_width)}"
+                )
+            # each digit is computed on its own: tiling them into one image
+            # changes the block normalization results in the last float bit
+            out[i] = descriptor.compute(digit).ravel()
+        return out
+
+
+DEFAULT_HOG_FEATURE_EXTRACTOR = HogFeatureExtractor()
 
 
 def preprocess_hog(digit_rois):
     # https://learnopencv.com/handwritten-digits-classification-an-opencv-c-python-tutorial/
-    samples = []
-    for digit in digit_rois:
-        hog = cv2.HOGDescriptor((20, 20), (10, 10), (5, 5), (10, 10), 9)
-        hist = hog.compute(digit)
-        samples.append(hist)
-    return np.float32(samples)
+    return DEFAULT_HOG_FEATURE_EXTRACTOR.compute(digit_rois)
 
 
-def ocr_digit_samples_knn(__samples, knn_model: cv2.ml.KNearest, k: int = 4):
-    _, results, _, _ = knn_model.findNearest(__samples, k)
-    result_list = [int(r) for r in results.ravel()]
+def digit_labels_to_int(labels) -> int:
+    result_list = [int(r) for r in np.ravel(labels)]
     result_str = "".join(str(r) for r in result_list if r > -1)
     return int(result_str) if result_str else 0
 
 
-def ocr_digits_by_contour_get_samples(__roi_gray: Mat, size: int):
+def ocr_digit_samples_knn(__samples, knn_model: cv2.ml.KNearest, k: int = 4):
+    _, results, _, _ = knn_model.findNearest(__samples, k)
+    return digit_labels_to_int(results)
+
+
+class KnnDigitResults(NamedTuple):
+    """The KNN results of the digits of one field."""
+
+    labels: np.ndarray
+    confidences: np.ndarray
+    """
+    per digit, in `[0, 1]`: the share of the k neighbours that voted for the
+    label, times how much closer the nearest of them is than the nearest
+    neighbour of another label (`d_other / (d_same + d_other)`, 1 if all
+    neighbours agree)
+    """
+    distances: np.ndarray
+    """per digit, the squared distance to the nearest neighbour of the label"""
+
+    @classmethod
+    def from_find_nearest(
+        cls, results: np.ndarray, neighbour_responses: np.ndarray, dists: np.ndarray
+    ):
+        labels = results.ravel()
+        agree = neighbour_responses == labels[:, None]
+        same_distances = np.where(agree, dists, np.inf).min(axis=1)
+        other_distances = np.where(agree, np.inf, dists).min(axis=1)
+        total_distances = same_distances + other_distances
+        margins = np.ones(len(labels), np.float32)
+        disagreed = ~agree.all(axis=1)
+        margins[disagreed] = np.divide(
+            other_distances[disagreed],
+            total_distances[disagreed],
+            out=np.full(np.count_nonzero(disagreed), 0.5, np.float32),
+            where=total_distances[disagreed] > 0,
+        )
+        return cls(
+            labels=labels,
+            confidences=(agree.mean(axis=1) * margins).astype(np.float32),
+            distances=same_distances.astype(np.float32),
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            labels=np.empty(0, np.float32),
+            confidences=np.empty(0, np.float32),
+            distances=np.empty(0, np.float32),
+        )
+
+    def value(self) -> int:
+        return digit_labels_to_int(self.labels)
+
+    def confidence(self) -> float:
+        """The confidence of the least confident digit, 0 without digits."""
+        return float(self.confidences.min()) if len(self.labels) else 0.0
+
+
+def _split_knn_digit_results(
+    results: KnnDigitResults, sizes: Sequence[int]
+) -> List[KnnDigitResults]:
+    offsets = np.cumsum([0, *sizes])
+    return [
+        KnnDigitResults(*(array[start:end] for array in results))
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def knn_classify_batch(
+    samples_list: Sequence[np.ndarray], knn_model: cv2.ml.KNearest, k: int = 4
+) -> List[KnnDigitResults]:
+    """
+    Classify the digit samples of several fields with a single `findNearest`
+    call, and split the results back per field.
+
+    :param samples_list: one `(n, feature_size)` sample matrix per field,
+        fields may be empty
+    :return: one `KnnDigitResults` per field, in order
+    """
+    sizes = [len(samples) for samples in samples_list]
+    if sum(sizes) == 0:
+        return [KnnDigitResults.empty() for _ in samples_list]
+
+    batch = np.concatenate(
+        [
+            np.asarray(samples, np.float32).reshape(len(samples), -1)
+            for samples in samples_list
+            if len(samples)
+        ]
+    )
+    _, results, neighbour_responses, dists = knn_model.findNearest(batch, k)
+    return _split_knn_digit_results(
+        KnnDigitResults.from_find_nearest(results, neighbour_responses, dists), sizes
+    )
+
+
+def knn_find_nearest_batch(
+    samples_list: Sequence[np.ndarray], knn_model: cv2.ml.KNearest, k: int = 4
+) -> List[np.ndarray]:
+    """`knn_classify_batch`, only the label array of every field."""
+    return [
+        results.labels for results in knn_classify_batch(samples_list, knn_model, k)
+    ]
+
+
+def ocr_digit_samples_knn_batch(
+    samples_list: Sequence[np.ndarray], knn_model: cv2.ml.KNearest, k: int = 4
+) -> List[int]:
+    """Batch version of `ocr_digit_samples_knn`, one integer per field."""
+    return [
+        results.value() for results in knn_classify_batch(samples_list, knn_model, k)
+    ]
+
+
+class KnnGlyphMemo:
+    """
+    Remembers the KNN results of every normalized digit glyph it has seen, so
+    that only new glyphs go through HOG and `findNearest`.
+
+    Glyphs are keyed by their exact pixels, so a memoized label is always the
+    label the model would return. A memo is bound to one model and `k`,
+    share it between `DeviceOcr` / `ChieriBotV4Ocr` instances that use the
+    same model.
+    """
+
+    def __init__(
+        self,
+        knn_model: cv2.ml.KNearest,
+        *,
+        k: int = 4,
+        maxsize: int = 4096,
+        hog_extractor: Optional[HogFeatureExtractor] = None,
+    ):
+        self.knn_model = knn_model
+        self.k = k
+        self.hog_extractor = hog_extractor or DEFAULT_HOG_FEATURE_EXTRACTOR
+        self.cache: LruCache[Tuple[float, float, float]] = LruCache(maxsize)
+
+    def classify_batch(
+        self, digits_list: Sequence[np.ndarray]
+    ) -> List[KnnDigitResults]:
+        """
+        :param digits_list: one `(n, size, size)` glyph batch per field, see
+            `normalize_digits`
+        :return: one `KnnDigitResults` per field, like `knn_classify_batch`
+        """
+        digits = [digit for field_digits in digits_list for digit in field_digits]
+        # label, confidence, distance
+        values = np.empty((len(digits), 3), np.float32)
+
+        # a 20x20 glyph is only 400 bytes, key on the pixels themselves
+        missing: Dict[bytes, List[int]] = {}
+        for i, digit in enumerate(digits):
+            key = digit.tobytes()
+            cached = self.cache.get(key)
+            if cached is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                values[i] = cached
+
+        if missing:
+            samples = self.hog_extractor.compute(
+                [digits[positions[0]] for positions in missing.values()]
+            )
+            new_results = KnnDigitResults.from_find_nearest(
+                *self.knn_model.findNearest(samples, self.k)[1:]
+            )
+            new_values = np.stack(
+                [new_results.labels, new_results.confidences, new_results.distances],
+                axis=1,
+            )
+            for (key, positions), value in zip(missing.items(), new_values):
+                values[positions] = value
+                self.cache.put(key, tuple(value.tolist()))
+
+        results = KnnDigitResults(values[:, 0], values[:, 1], values[:, 2])
+        return _split_knn_digit_results(results, [len(d) for d in digits_list])
+
+    def labels_batch(self, digits_list: Sequence[np.ndarray]) -> List[np.ndarray]:
+        return [results.labels for results in self.classify_batch(digits_list)]
+
+    def ocr_digits_batch(self, digits_list: Sequence[np.ndarray]) -> List[int]:
+        return [results.value() for results in self.classify_batch(digits_list)]
+
+    def ocr_digits(self, digits: np.ndarray) -> int:
+        return self.ocr_digits_batch([digits])[0]
+
+    def info(self) -> CacheInfo:
+        return self.cache.info()
+
+    def clear(self):
+        self.cache.clear()
+
+
+def knn_classify_digits_batch(
+    digits_list: Sequence[np.ndarray],
+    knn_model: cv2.ml.KNearest,
+    k: int = 4,
+    *,
+    memo: Optional[KnnGlyphMemo] = None,
+) -> List[KnnDigitResults]:
+    """
+    `knn_classify_batch` on normalized glyphs instead of HOG samples.
+    With a `memo`, the glyphs it has not seen are classified through it. The
+    memo must be bound to `knn_model` and `k`, otherwise `ValueError`.
+    """
+    if memo is not None:
+        if memo.knn_model is not knn_model:
+            raise ValueError("The glyph memo is bound to another KNN model")
+        if memo.k != k:
+            raise ValueError(f"The glyph memo is bound to k={memo.k}, not k={k}")
+        return memo.classify_batch(digits_list)
+    return knn_classify_batch(
+        [preprocess_hog(digits) for digits in digits_list], knn_model, k
+    )
+
+
+def knn_find_nearest_digits_batch(
+    digits_list: Sequence[np.ndarray],
+    knn_model: cv2.ml.KNearest,
+    k: int = 4,
+    *,
+    memo: Optional[KnnGlyphMemo] = None,
+) -> List[np.ndarray]:
+    """`knn_classify_digits_batch`, only the label array of every field."""
+    return [
+        results.labels
+        for results in knn_classify_digits_batch(digits_list, knn_model, k, memo=memo)
+    ]
+
+
+def ocr_digits_by_contour_get_digits(__roi_gray: Mat, size: int):
     roi = __roi_gray.copy()
     contours, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
     rects = [cv2.boundingRect(c) for c in contours]
@@ -165,8 +531,11 @@ def ocr_digits_by_contour_get_samples(__roi_gray: Mat, size: int):
     rects = FixRects.split_connected(roi, rects)
     rects = sorted(rects, key=lambda r: r[0])
     # digit_rois = [cv2.resize(crop_xywh(roi, rect), size) for rect in rects]
-    digit_rois = [resize_fill_square(crop_xywh(roi, rect), size) for rect in rects]
-    return preprocess_hog(digit_rois)
+    return normalize_digits(roi, rects, size)
+
+
+def ocr_digits_by_contour_get_samples(__roi_gray: Mat, size: int):
+    return preprocess_hog(ocr_digits_by_contour_get_digits(__roi_gray, size))
 
 
 def ocr_digits_by_contour_knn(
@@ -178,3 +547,95 @@ def ocr_digits_by_contour_knn(
 ) -> int:
     samples = ocr_digits_by_contour_get_samples(__roi_gray, size)
     return ocr_digit_samples_knn(samples, knn_model, k)
+
+
+class ConnectedComponents(NamedTuple):
+    """
+    The foreground blobs of a binary image, from a single
+    `cv2.connectedComponentsWithStats` pass.
+
+    Unlike `cv2.findContours(..., cv2.RETR_EXTERNAL, ...)`, blobs inside the
+    holes of other blobs are components of their own, and `areas` are pixel
+    counts rather than contour areas.
+    """
+
+    labels: np.ndarray
+    """label image, 0 is the background"""
+    label_ids: np.ndarray
+    """the label of every component in `labels`"""
+    rects: np.ndarray
+    """`(n, 4)` xywh bounding rects"""
+    areas: np.ndarray
+    """`(n,)` pixel counts"""
+
+    @classmethod
+    def from_image(cls, img_bin: Mat, connectivity: int = 8):
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(
+            img_bin, connectivity=connectivity
+        )
+        return cls(
+            labels=labels,
+            label_ids=np.arange(1, len(stats), dtype=labels.dtype),
+            rects=stats[1:, :4],
+            areas=stats[1:, cv2.CC_STAT_AREA],
+        )
+
+    def select(self, keep: np.ndarray) -> "ConnectedComponents":
+        """Keep the components where the boolean `keep` is set."""
+        return self._replace(
+            label_ids=self.label_ids[keep],
+            rects=self.rects[keep],
+            areas=self.areas[keep],
+        )
+
+    def mask(self) -> np.ndarray:
+        """Boolean image of the pixels that belong to these components."""
+        lut = np.zeros(self.labels.max() + 1, dtype=bool)
+        lut[self.label_ids] = True
+        return lut[self.labels]
+
+    def erase_others(self, img: Mat) -> Mat:
+        """A copy of `img` with every pixel outside these components set to 0."""
+        return np.where(self.mask(), img, 0).astype(img.dtype)
+
+    def rect_tuples(self) -> List[Tuple[int, int, int, int]]:
+        return [tuple(rect) for rect in self.rects.tolist()]
+
+
+def ocr_digits_by_components_get_digits(
+    __roi_gray: Mat, size: int, components: Optional[ConnectedComponents] = None
+):
+    """
+    `ocr_digits_by_contour_get_digits` on top of `ConnectedComponents`.
+
+    :param components: components already found on `__roi_gray`, e.g. after
+        filtering noise with `select` and `erase_others`
+    """
+    roi = __roi_gray
+    if components is None:
+        components = ConnectedComponents.from_image(roi)
+    rects = FixRects.connect_broken(
+        components.rect_tuples(), roi.shape[1], roi.shape[0]
+    )
+    rects = FixRects.split_connected(roi, rects)
+    rects = sorted(rects, key=lambda r: r[0])
+    return normalize_digits(roi, rects, size)
+
+
+def ocr_digits_by_components_get_samples(
+    __roi_gray: Mat, size: int, components: Optional[ConnectedComponents] = None
+):
+    return preprocess_hog(
+        ocr_digits_by_components_get_digits(__roi_gray, size, components)
+    )
+
+
+def ocr_digits_by_components_knn(
+    __roi_gray: Mat,
+    knn_model: cv2.ml.KNearest,
+    *,
+    k=4,
+    size: int = 20,
+) -> int:
+    samples = ocr_digits_by_components_get_samples(__roi_gray, size)
+    return ocr_digit_samples_knn(samples, knn_model, k)
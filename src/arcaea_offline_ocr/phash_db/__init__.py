@@ -0,0 +1,10 @@
+from .builder import ImagePhashDatabaseBuilder, PhashBuildResult
+from .database import ImagePhashDatabase, PhashArrays, PhashHashTable
+from .hashing import *
+from .index import PhashMultiIndex
+from .reloadable import ReloadableImagePhashDatabase
+from .shared import (
+    SharedImagePhashDatabase,
+    SharedPhashDatabaseDescriptor,
+    attach_shared_phash_database,
+)
@@ -0,0 +1,293 @@
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import attrs
+import cv2
+import numpy as np
+
+from .database import PARTNER_ICON_ID_PREFIX
+from .hashing import calculate_thumbnail, phash_opencv
+
+__all__ = ["ImagePhashDatabaseBuilder", "PhashBuildResult"]
+
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS properties (key TEXT PRIMARY KEY, value TEXT)",
+    # no primary key or index on `id`: readers select `id` and `hash` in two
+    # queries and pair them by position, an index would return the ids in
+    # sorted order and the hashes in rowid order. The builder keeps ids unique.
+    "CREATE TABLE IF NOT EXISTS hashes (id TEXT, hash BLOB)",
+    "CREATE TABLE IF NOT EXISTS thumbnails (id TEXT PRIMARY KEY, thumbnail BLOB)",
+    "CREATE TABLE IF NOT EXISTS sources ("
+    "id TEXT PRIMARY KEY, path TEXT, mtime_ns INTEGER, size INTEGER, digest TEXT"
+    ")",
+]
+
+
+@attrs.define
+class PhashBuildResult:
+    added: List[str] = attrs.field(factory=list)
+    updated: List[str] = attrs.field(factory=list)
+    unchanged: List[str] = attrs.field(factory=list)
+    removed: List[str] = attrs.field(factory=list)
+    built_timestamp: Optional[int] = None
+
+
+@attrs.define
+class _Source:
+    id: str
+    path: str
+    mtime_ns: int
+    size: int
+    digest: Optional[str] = None
+
+
+def _hash_image_file(
+    args: Tuple[str, Optional[str], int, int, int]
+) -> Tuple[str, Optional[bytes], Optional[bytes]]:
+    """
+    Process pool worker. Returns the file digest, and the hash and thumbnail
+    bytes unless the digest equals the known one.
+    """
+    path, known_digest, hash_size, highfreq_factor, thumbnail_size = args
+    # read the file once for both the digest and the decoding,
+    # `imread_unicode` style so that non-ascii paths work
+    file_bytes = np.fromfile(path, dtype=np.uint8)
+    digest = hashlib.sha1(file_bytes.data).hexdigest()
+    if digest == known_digest:
+        return digest, None, None
+
+    img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Cannot decode image {path!r}")
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    image_hash = phash_opencv(
+        img_gray, hash_size=hash_size, highfreq_factor=highfreq_factor
+    )
+    thumbnail = (
+        calculate_thumbnail(img_gray, thumbnail_size).tobytes()
+        if thumbnail_size
+        else None
+    )
+    return digest, image_hash.flatten().tobytes(), thumbnail
+
+
+class ImagePhashDatabaseBuilder:
+    """
+    Build or incrementally update the SQLite database read by
+    `ImagePhashDatabase`.
+
+    Besides `properties` and `hashes`, the builder keeps a `sources` table with
+    the path, mtime, size and content digest of every hashed file. On later
+    builds a file is only re-hashed when its mtime or size changed *and* its
+    content digest differs. Hashing runs in a process pool.
+
+    With `thumbnail_size`, a small grayscale thumbnail of every image is stored
+    in a `thumbnails` table for `ImagePhashDatabase.lookup_jackets_reranked`.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        *,
+        hash_size: int = 8,
+        highfreq_factor: int = 4,
+        thumbnail_size: Optional[int] = 32,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        :param max_workers: process pool size, `None` for `os.cpu_count()`.
+            With a single worker, images are hashed in the current process.
+        """
+        self.db_path = db_path
+        self.hash_size = hash_size
+        self.highfreq_factor = highfreq_factor
+        self.thumbnail_size = thumbnail_size or 0
+        self.max_workers = max_workers
+
+    def _hash_files(
+        self, sources: List[_Source], known_digests: Dict[str, str]
+    ) -> List[Tuple[str, Optional[bytes], Optional[bytes]]]:
+        tasks = [
+            (
+                s.path,
+                known_digests.get(s.id),
+                self.hash_size,
+                self.highfreq_factor,
+                self.thumbnail_size,
+            )
+            for s in sources
+        ]
+        max_workers = self.max_workers or os.cpu_count() or 1
+        if max_workers == 1 or len(tasks) <= 1:
+            return [_hash_image_file(task) for task in tasks]
+
+        chunksize = max(1, len(tasks) // (max_workers * 4))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_hash_image_file, tasks, chunksize=chunksize))
+
+    @staticmethod
+    def _migrate_hashes_table(conn: sqlite3.Connection):
+        """Drop the `id` primary key of databases built by earlier versions."""
+        columns = conn.execute("PRAGMA table_info(hashes)").fetchall()
+        # (cid, name, type, notnull, dflt_value, pk)
+        if not any(column[5] for column in columns):
+            return
+        conn.execute("ALTER TABLE hashes RENAME TO hashes_old")
+        conn.execute("CREATE TABLE hashes (id TEXT, hash BLOB)")
+        conn.execute("INSERT INTO hashes (id, hash) SELECT id, hash FROM hashes_old")
+        conn.execute("DROP TABLE hashes_old")
+
+    @staticmethod
+    def _check_hashes_order(conn: sqlite3.Connection):
+        """
+        Raise if `SELECT id` and `SELECT hash` would not return the rows in the
+        same order, which silently mismatches ids and hashes in readers.
+        """
+        ids = [r[0] for r in conn.execute("SELECT id FROM hashes")]
+        rows = conn.execute("SELECT id, hash FROM hashes").fetchall()
+        if ids != [r[0] for r in rows]:
+            raise RuntimeError(
+                "The hashes table returns ids and hashes in different orders"
+            )
+
+    @staticmethod
+    def _read_properties(conn: sqlite3.Connection) -> Dict[str, str]:
+        return dict(conn.execute("SELECT key, value FROM properties").fetchall())
+
+    @staticmethod
+    def _write_properties(conn: sqlite3.Connection, properties: Dict[str, str]):
+        conn.executemany(
+            "DELETE FROM properties WHERE key = ?", [(k,) for k in properties]
+        )
+        conn.executemany(
+            "INSERT INTO properties (key, value) VALUES (?, ?)", properties.items()
+        )
+
+    def build(
+        self,
+        jackets: Mapping[str, str],
+        partner_icons: Optional[Mapping[str, str]] = None,
+        *,
+        prune: bool = True,
+    ) -> PhashBuildResult:
+        """
+        Hash new or changed images and write them to the database.
+
+        :param jackets: song id -> jacket image path
+        :param partner_icons: partner id -> partner icon image path, stored with
+            the `partner_icon||` id prefix
+        :param prune: remove database entries that are not in the inputs
+        """
+        entries = dict(jackets)
+        entries.update(
+            (f"{PARTNER_ICON_ID_PREFIX}{partner_id}", path)
+            for partner_id, path in (partner_icons or {}).items()
+        )
+
+        result = PhashBuildResult()
+        with sqlite3.connect(self.db_path) as conn:
+            # one transaction, schema changes included
+            conn.execute("BEGIN")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._migrate_hashes_table(conn)
+
+            properties = self._read_properties(conn)
+            config = {
+                "hash_size": str(self.hash_size),
+                "highfreq_factor": str(self.highfreq_factor),
+                "thumbnail_size": str(self.thumbnail_size),
+            }
+            if any(properties.get(k) != v for k, v in config.items()):
+                # hashes of another configuration cannot be reused
+                conn.execute("DELETE FROM hashes")
+                conn.execute("DELETE FROM thumbnails")
+                conn.execute("DELETE FROM sources")
+
+            stored_ids = {r[0] for r in conn.execute("SELECT id FROM hashes")}
+            stored_sources = {
+                r[0]: _Source(*r)
+                for r in conn.execute(
+                    "SELECT id, path, mtime_ns, size, digest FROM sources"
+                )
+            }
+
+            pending: List[_Source] = []
+            known_digests: Dict[str, str] = {}
+            for _id, path in entries.items():
+                stat = os.stat(path)
+                source = _Source(_id, os.fspath(path), stat.st_mtime_ns, stat.st_size)
+                stored = stored_sources.get(_id)
+                if stored is not None and _id in stored_ids:
+                    if (stored.path, stored.mtime_ns, stored.size) == (
+                        source.path,
+                        source.mtime_ns,
+                        source.size,
+                    ):
+                        result.unchanged.append(_id)
+                        continue
+                    known_digests[_id] = stored.digest
+                pending.append(source)
+
+            hash_rows = []
+            thumbnail_rows = []
+            for source, (digest, hash_bytes, thumbnail_bytes) in zip(
+                pending, self._hash_files(pending, known_digests)
+            ):
+                source.digest = digest
+                if hash_bytes is None:
+                    result.unchanged.append(source.id)
+                    continue
+                hash_rows.append((source.id, hash_bytes))
+                if thumbnail_bytes is not None:
+                    thumbnail_rows.append((source.id, thumbnail_bytes))
+                if source.id in stored_ids:
+                    result.updated.append(source.id)
+                else:
+                    result.added.append(source.id)
+
+            if prune:
+                result.removed = sorted(stored_ids - entries.keys())
+
+            conn.executemany(
+                "DELETE FROM hashes WHERE id = ?",
+                [(i,) for i in result.removed] + [(r[0],) for r in hash_rows],
+            )
+            conn.executemany("INSERT INTO hashes (id, hash) VALUES (?, ?)", hash_rows)
+            conn.executemany(
+                "DELETE FROM thumbnails WHERE id = ?",
+                [(i,) for i in result.removed] + [(r[0],) for r in hash_rows],
+            )
+            conn.executemany(
+                "INSERT INTO thumbnails (id, thumbnail) VALUES (?, ?)", thumbnail_rows
+            )
+            conn.executemany(
+                "DELETE FROM sources WHERE id = ?",
+                [(i,) for i in result.removed] + [(s.id,) for s in pending],
+            )
+            conn.executemany(
+                "INSERT INTO sources (id, path, mtime_ns, size, digest) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(s.id, s.path, s.mtime_ns, s.size, s.digest) for s in pending],
+            )
+
+            # raising rolls the whole build back
+            self._check_hashes_order(conn)
+
+            built_timestamp = int(properties.get("built_timestamp", 0))
+            if hash_rows or result.removed or not built_timestamp:
+                # keep the timestamp strictly increasing, readers use it to
+                # detect a new build
+                built_timestamp = max(int(time.time()), built_timestamp + 1)
+            self._write_properties(
+                conn, {**config, "built_timestamp": str(built_timestamp)}
+            )
+            result.built_timestamp = built_timestamp
+
+        conn.close()
+        return result
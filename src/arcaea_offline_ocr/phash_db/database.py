@@ -0,0 +1,568 @@
+import itertools
+import os
+import sqlite3
+import zipfile
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..cache import LruCache, image_digest
+from ..types import Mat
+from .hashing import (
+    calculate_thumbnail,
+    hamming_distance_matrix,
+    hamming_distances,
+    normalize_thumbnails,
+    pack_hashes,
+    phash_opencv,
+    phash_opencv_batch,
+    top_k_indices,
+)
+from .index import PhashMultiIndex
+
+PARTNER_ICON_ID_PREFIX = "partner_icon||"
+
+
+class PhashHashTable(NamedTuple):
+    """Hash rows of a database, in the order of the `hashes` table."""
+
+    ids: List[str]
+    hashes: np.ndarray
+    """`(n, hash_size ** 2)` booleans"""
+    partner_icon_mask: np.ndarray
+    category_ids: List[str]
+    """jacket ids, or partner icon ids with their prefix removed"""
+    thumbnails: Optional[np.ndarray] = None
+    """`(n, thumbnail_size ** 2)` uint8 rerank thumbnails, or `None`"""
+
+
+class PhashArrays(NamedTuple):
+    """
+    The lookup arrays of an `ImagePhashDatabase`, for all rows and split into
+    jackets and partner icons.
+    """
+
+    ids: List[str]
+    hashes: np.ndarray
+    hashes_packed: np.ndarray
+    jacket_ids: List[str]
+    jacket_hashes: np.ndarray
+    jacket_hashes_packed: np.ndarray
+    partner_icon_ids: List[str]
+    partner_icon_hashes: np.ndarray
+    partner_icon_hashes_packed: np.ndarray
+    thumbnails: Optional[np.ndarray] = None
+    """normalized rerank thumbnails, see `normalize_thumbnails`"""
+    jacket_thumbnails: Optional[np.ndarray] = None
+    partner_icon_thumbnails: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_hash_table(cls, table: PhashHashTable) -> "PhashArrays":
+        hashes_packed = pack_hashes(table.hashes)
+        partner_icon_mask = table.partner_icon_mask
+        jacket_mask = ~partner_icon_mask
+
+        thumbnails = jacket_thumbnails = partner_icon_thumbnails = None
+        if table.thumbnails is not None:
+            thumbnails = normalize_thumbnails(table.thumbnails)
+            jacket_thumbnails = thumbnails[jacket_mask]
+            partner_icon_thumbnails = thumbnails[partner_icon_mask]
+
+        return cls(
+            ids=table.ids,
+            hashes=table.hashes,
+            hashes_packed=hashes_packed,
+            jacket_ids=list(itertools.compress(table.category_ids, jacket_mask)),
+            jacket_hashes=table.hashes[jacket_mask],
+            jacket_hashes_packed=np.ascontiguousarray(hashes_packed[jacket_mask]),
+            partner_icon_ids=list(
+                itertools.compress(table.category_ids, partner_icon_mask)
+            ),
+            partner_icon_hashes=table.hashes[partner_icon_mask],
+            partner_icon_hashes_packed=np.ascontiguousarray(
+                hashes_packed[partner_icon_mask]
+            ),
+            thumbnails=thumbnails,
+            jacket_thumbnails=jacket_thumbnails,
+            partner_icon_thumbnails=partner_icon_thumbnails,
+        )
+
+
+class ImagePhashDatabase:
+    SNAPSHOT_VERSION = 2
+
+    def __init__(
+        self,
+        db_path: str,
+        *,
+        use_index: bool = False,
+        snapshot_path: Optional[str] = None,
+        cache_size: Optional[int] = None,
+    ):
+        """
+        :param use_index: build a `PhashMultiIndex` for jackets, partner icons
+            and all hashes at load time, and use it for single lookups. Set
+            `self.use_index` to `False` later to fall back to brute force.
+        :param snapshot_path: an optional `.npz` sidecar file. When it matches
+            the database's `built_timestamp` the hashes are loaded from it,
+            otherwise they are read from the database and the snapshot is
+            (re)written.
+        :param cache_size: if set, keep an `LruCache` of this size in front of
+            `calculate_phash`, `lookup_jacket` and `lookup_partner_icon`, keyed
+            by a digest of the input image. It is cleared by `reload`.
+        """
+        self._init_state(db_path, snapshot_path, cache_size)
+        self._load(use_index)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: PhashArrays,
+        *,
+        hash_size: int,
+        highfreq_factor: int,
+        built_timestamp: int,
+        thumbnail_size: int = 0,
+        db_path: Optional[str] = None,
+        use_index: bool = False,
+        cache_size: Optional[int] = None,
+        buffer_owner: Any = None,
+    ) -> "ImagePhashDatabase":
+        """
+        A database over already loaded arrays, which are used as is, e.g.
+        read-only views of shared memory. `db_path` is only read by `reload`.
+
+        :param buffer_owner: an object the arrays depend on, such as their
+            `SharedMemory` block, kept alive with the database
+        """
+        database = cls.__new__(cls)
+        database._init_state(db_path, None, cache_size, buffer_owner)
+        database._init_properties(
+            hash_size=hash_size,
+            highfreq_factor=highfreq_factor,
+            built_timestamp=built_timestamp,
+            thumbnail_size=thumbnail_size,
+        )
+        database._init_arrays(arrays, use_index)
+        return database
+
+    def _init_state(
+        self,
+        db_path: Optional[str],
+        snapshot_path: Optional[str],
+        cache_size: Optional[int],
+        buffer_owner: Any = None,
+    ):
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path
+        self.cache: Optional[LruCache] = LruCache(cache_size) if cache_size else None
+        self.buffer_owner = buffer_owner
+
+    def _init_properties(
+        self,
+        hash_size: int,
+        highfreq_factor: int,
+        built_timestamp: int,
+        thumbnail_size: int,
+    ):
+        self.hash_size = hash_size
+        self.highfreq_factor = highfreq_factor
+        self.built_timestamp = built_timestamp
+        self.thumbnail_size = thumbnail_size
+
+    def _load(self, use_index: bool):
+        snapshot_path = self.snapshot_path
+        with sqlite3.connect(self.db_path) as conn:
+            # read properties and hashes from the same database state, even if
+            # a builder commits in between
+            conn.execute("BEGIN")
+            properties = dict(
+                conn.execute("SELECT key, value FROM properties").fetchall()
+            )
+            self._init_properties(
+                hash_size=int(properties["hash_size"]),
+                highfreq_factor=int(properties["highfreq_factor"]),
+                built_timestamp=int(properties["built_timestamp"]),
+                thumbnail_size=int(properties.get("thumbnail_size") or 0),
+            )
+
+            table = None
+            if snapshot_path is not None:
+                table = self.load_snapshot(snapshot_path)
+            if table is None:
+                table = self.read_hash_table(conn)
+                if snapshot_path is not None:
+                    self.save_snapshot(snapshot_path, table)
+
+        self._init_arrays(PhashArrays.from_hash_table(table), use_index)
+
+    def reload(self):
+        """
+        Re-read the database file in place and invalidate the cache.
+
+        Lookups running concurrently may see a partially reloaded database, use
+        a fresh instance to swap databases under load.
+        """
+        self._load(self.use_index)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _init_arrays(self, arrays: PhashArrays, use_index: bool):
+        self.arrays = arrays
+        self.ids = arrays.ids
+        self.hashes = arrays.hashes
+        self.hashes_packed = arrays.hashes_packed
+        self.jacket_ids = arrays.jacket_ids
+        self.jacket_hashes = arrays.jacket_hashes
+        self.jacket_hashes_packed = arrays.jacket_hashes_packed
+        self.partner_icon_ids = arrays.partner_icon_ids
+        self.partner_icon_hashes = arrays.partner_icon_hashes
+        self.partner_icon_hashes_packed = arrays.partner_icon_hashes_packed
+        self.thumbnails = arrays.thumbnails
+        self.jacket_thumbnails = arrays.jacket_thumbnails
+        self.partner_icon_thumbnails = arrays.partner_icon_thumbnails
+
+        self.use_index = use_index
+        self.index: Optional[PhashMultiIndex] = None
+        self.jacket_index: Optional[PhashMultiIndex] = None
+        self.partner_icon_index: Optional[PhashMultiIndex] = None
+        if use_index:
+            self.build_index()
+
+    def read_hash_table(self, conn: sqlite3.Connection) -> PhashHashTable:
+        """Read the `hashes` table, and `thumbnails` if any, in a single query."""
+        if self.thumbnail_size:
+            rows = conn.execute(
+                "SELECT h.id, h.hash, t.thumbnail FROM hashes h "
+                "LEFT JOIN thumbnails t ON t.id = h.id"
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT id, hash FROM hashes").fetchall()
+        ids = [row[0] for row in rows]
+        hashes = np.frombuffer(b"".join(row[1] for row in rows), bool).reshape(
+            len(rows), self.hash_size**2
+        )
+
+        thumbnails = None
+        if self.thumbnail_size and all(row[2] is not None for row in rows):
+            thumbnails = np.frombuffer(
+                b"".join(row[2] for row in rows), np.uint8
+            ).reshape(len(rows), self.thumbnail_size**2)
+
+        partner_icon_mask = np.fromiter(
+            (_id.startswith(PARTNER_ICON_ID_PREFIX) for _id in ids), bool, len(ids)
+        )
+        category_ids = [
+            _id.split("||")[1] if is_partner_icon else _id
+            for _id, is_partner_icon in zip(ids, partner_icon_mask)
+        ]
+        return PhashHashTable(ids, hashes, partner_icon_mask, category_ids, thumbnails)
+
+    def load_snapshot(self, snapshot_path: str) -> Optional[PhashHashTable]:
+        """
+        Load a snapshot written by `save_snapshot`. Returns `None` if the file
+        is missing, unreadable, or was written for another database build.
+        """
+        if not os.path.isfile(snapshot_path):
+            return None
+
+        try:
+            with np.load(snapshot_path, allow_pickle=False) as snapshot:
+                properties = tuple(int(v) for v in snapshot["properties"])
+                if properties != self._snapshot_properties():
+                    return None
+                return PhashHashTable(
+                    snapshot["ids"].tolist(),
+                    snapshot["hashes"],
+                    snapshot["partner_icon_mask"],
+                    snapshot["category_ids"].tolist(),
+                    (
+                        snapshot["thumbnails"]
+                        if "thumbnails" in snapshot.files
+                        else None
+                    ),
+                )
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def save_snapshot(self, snapshot_path: str, table: PhashHashTable):
+        """Write `table` to an uncompressed `.npz` file, replacing it atomically."""
+        arrays = {
+            "properties": np.array(self._snapshot_properties(), np.int64),
+            "ids": np.array(table.ids, dtype=str),
+            "hashes": table.hashes,
+            "partner_icon_mask": table.partner_icon_mask,
+            "category_ids": np.array(table.category_ids, dtype=str),
+        }
+        if table.thumbnails is not None:
+            arrays["thumbnails"] = table.thumbnails
+
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, snapshot_path)
+
+    def _snapshot_properties(self):
+        return (
+            self.SNAPSHOT_VERSION,
+            self.hash_size,
+            self.highfreq_factor,
+            self.built_timestamp,
+            self.thumbnail_size,
+        )
+
+    def build_index(self, **kwargs):
+        """Build the multi-index, `kwargs` are passed to `PhashMultiIndex`."""
+        hash_bits = self.hash_size**2
+        self.index = PhashMultiIndex(self.hashes_packed, hash_bits, **kwargs)
+        self.jacket_index = PhashMultiIndex(
+            self.jacket_hashes_packed, hash_bits, **kwargs
+        )
+        self.partner_icon_index = PhashMultiIndex(
+            self.partner_icon_hashes_packed, hash_bits, **kwargs
+        )
+
+    def calculate_phash(self, img_gray: Mat):
+        if self.cache is not None:
+            return self._calculate_phash_cached(img_gray, image_digest(img_gray))
+        return phash_opencv(
+            img_gray, hash_size=self.hash_size, highfreq_factor=self.highfreq_factor
+        )
+
+    def _calculate_phash_cached(self, img_gray: Mat, digest: bytes):
+        def compute():
+            image_hash = phash_opencv(
+                img_gray,
+                hash_size=self.hash_size,
+                highfreq_factor=self.highfreq_factor,
+            )
+            image_hash.flags.writeable = False
+            return image_hash
+
+        return self.cache.get_or_compute(("phash", digest), compute)
+
+    def _search_packed(
+        self,
+        hashes_packed: np.ndarray,
+        index: Optional[PhashMultiIndex],
+        image_hash: np.ndarray,
+        limit: int,
+        max_distance: Optional[int],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        query_packed = pack_hashes(image_hash.flatten())
+        if self.use_index and index is not None:
+            return index.search(query_packed, limit, max_distance=max_distance)
+
+        distances = hamming_distances(query_packed, hashes_packed)
+        indices = top_k_indices(distances, limit)
+        distances = distances[indices]
+        if max_distance is not None:
+            within = distances <= max_distance
+            indices, distances = indices[within], distances[within]
+        return indices, distances
+
+    def _lookup_packed(
+        self,
+        ids: Sequence[str],
+        hashes_packed: np.ndarray,
+        index: Optional[PhashMultiIndex],
+        image_hash: np.ndarray,
+        limit: int,
+        max_distance: Optional[int],
+    ) -> List[Tuple[str, int]]:
+        indices, distances = self._search_packed(
+            hashes_packed, index, image_hash, limit, max_distance
+        )
+        return [(ids[i], int(d)) for i, d in zip(indices, distances)]
+
+    def _lookup_reranked(
+        self,
+        ids: Sequence[str],
+        hashes_packed: np.ndarray,
+        index: Optional[PhashMultiIndex],
+        thumbnails: Optional[np.ndarray],
+        img_gray: Mat,
+        shortlist: int,
+        limit: int,
+    ) -> List[Tuple[str, float]]:
+        if thumbnails is None:
+            raise ValueError(
+                "This database has no rerank thumbnails, "
+                "build it with a thumbnail_size to enable reranking."
+            )
+
+        indices, _ = self._search_packed(
+            hashes_packed, index, self.calculate_phash(img_gray), shortlist, None
+        )
+        query = normalize_thumbnails(
+            calculate_thumbnail(img_gray, self.thumbnail_size)
+        )[0]
+        correlations = thumbnails[indices] @ query
+        order = np.argsort(-correlations, kind="stable")[:limit]
+        return [(ids[indices[i]], float(correlations[i])) for i in order]
+
+    @staticmethod
+    def _lookup_packed_batch(
+        ids: Sequence[str],
+        hashes_packed: np.ndarray,
+        image_hashes: np.ndarray,
+        limit: int,
+    ) -> List[List[Tuple[str, int]]]:
+        image_hashes = np.asarray(image_hashes, dtype=bool)
+        image_hashes = image_hashes.reshape(
+            image_hashes.shape[0], int(np.prod(image_hashes.shape[1:]))
+        )
+        distances = hamming_distance_matrix(pack_hashes(image_hashes), hashes_packed)
+        indices = top_k_indices(distances, limit)
+        return [
+            [(ids[i], int(row_distances[i])) for i in row_indices]
+            for row_distances, row_indices in zip(distances, indices)
+        ]
+
+    def calculate_phashes(self, imgs_gray: Sequence[Mat]) -> np.ndarray:
+        return phash_opencv_batch(
+            imgs_gray, hash_size=self.hash_size, highfreq_factor=self.highfreq_factor
+        ).reshape(len(imgs_gray), self.hash_size**2)
+
+    def lookup_hash(
+        self,
+        image_hash: np.ndarray,
+        *,
+        limit: int = 5,
+        max_distance: Optional[int] = None,
+    ):
+        return self._lookup_packed(
+            self.ids, self.hashes_packed, self.index, image_hash, limit, max_distance
+        )
+
+    def lookup_hashes_batch(self, image_hashes: np.ndarray, *, limit: int = 5):
+        """
+        Look up `N` hashes at once, `image_hashes` is anything that can be
+        reshaped into `(N, hash_size ** 2)` booleans.
+
+        Returns `N` lists of at most `limit` `(id, distance)` tuples.
+        """
+        return self._lookup_packed_batch(
+            self.ids, self.hashes_packed, image_hashes, limit
+        )
+
+    def lookup_image(self, img_gray: Mat):
+        image_hash = self.calculate_phash(img_gray)
+        return self.lookup_hash(image_hash, limit=1)[0]
+
+    def lookup_jackets(
+        self, img_gray: Mat, *, limit: int = 5, max_distance: Optional[int] = None
+    ):
+        return self._lookup_packed(
+            self.jacket_ids,
+            self.jacket_hashes_packed,
+            self.jacket_index,
+            self.calculate_phash(img_gray),
+            limit,
+            max_distance,
+        )
+
+    def lookup_jacket(self, img_gray: Mat):
+        if self.cache is None:
+            return self.lookup_jackets(img_gray, limit=1)[0]
+
+        digest = image_digest(img_gray)
+        return self.cache.get_or_compute(
+            ("jacket", digest),
+            lambda: self._lookup_packed(
+                self.jacket_ids,
+                self.jacket_hashes_packed,
+                self.jacket_index,
+                self._calculate_phash_cached(img_gray, digest),
+                1,
+                None,
+            )[0],
+        )
+
+    def lookup_jackets_reranked(
+        self, img_gray: Mat, *, shortlist: int = 10, limit: int = 5
+    ):
+        """
+        Two-stage jacket lookup: the `shortlist` nearest jackets by phash are
+        reranked by the normalized cross-correlation of their stored thumbnails
+        with the query.
+
+        Returns at most `limit` `(id, correlation)` tuples, best first. The
+        database must have been built with thumbnails.
+        """
+        return self._lookup_reranked(
+            self.jacket_ids,
+            self.jacket_hashes_packed,
+            self.jacket_index,
+            self.jacket_thumbnails,
+            img_gray,
+            shortlist,
+            limit,
+        )
+
+    def lookup_jacket_reranked(self, img_gray: Mat, *, shortlist: int = 10):
+        return self.lookup_jackets_reranked(img_gray, shortlist=shortlist, limit=1)[0]
+
+    def lookup_jackets_batch(self, imgs_gray: Sequence[Mat], *, limit: int = 5):
+        return self._lookup_packed_batch(
+            self.jacket_ids,
+            self.jacket_hashes_packed,
+            self.calculate_phashes(imgs_gray),
+            limit,
+        )
+
+    def lookup_partner_icons(
+        self, img_gray: Mat, *, limit: int = 5, max_distance: Optional[int] = None
+    ):
+        return self._lookup_packed(
+            self.partner_icon_ids,
+            self.partner_icon_hashes_packed,
+            self.partner_icon_index,
+            self.calculate_phash(img_gray),
+            limit,
+            max_distance,
+        )
+
+    def lookup_partner_icon(self, img_gray: Mat):
+        if self.cache is None:
+            return self.lookup_partner_icons(img_gray, limit=1)[0]
+
+        digest = image_digest(img_gray)
+        return self.cache.get_or_compute(
+            ("partner_icon", digest),
+            lambda: self._lookup_packed(
+                self.partner_icon_ids,
+                self.partner_icon_hashes_packed,
+                self.partner_icon_index,
+                self._calculate_phash_cached(img_gray, digest),
+                1,
+                None,
+            )[0],
+        )
+
+    def lookup_partner_icons_reranked(
+        self, img_gray: Mat, *, shortlist: int = 10, limit: int = 5
+    ):
+        """The partner icon counterpart of `lookup_jackets_reranked`."""
+        return self._lookup_reranked(
+            self.partner_icon_ids,
+            self.partner_icon_hashes_packed,
+            self.partner_icon_index,
+            self.partner_icon_thumbnails,
+            img_gray,
+            shortlist,
+            limit,
+        )
+
+    def lookup_partner_icon_reranked(self, img_gray: Mat, *, shortlist: int = 10):
+        return self.lookup_partner_icons_reranked(
+            img_gray, shortlist=shortlist, limit=1
+        )[0]
+
+    def lookup_partner_icons_batch(self, imgs_gray: Sequence[Mat], *, limit: int = 5):
+        return self._lookup_packed_batch(
+            self.partner_icon_ids,
+            self.partner_icon_hashes_packed,
+            self.calculate_phashes(imgs_gray),
+            limit,
+        )
@@ -0,0 +1,199 @@
+from typing import Sequence, Union
+
+import cv2
+import numpy as np
+
+from ..types import Mat
+
+__all__ = [
+    "phash_opencv",
+    "phash_opencv_batch",
+    "hamming_distance_sql_function",
+    "calculate_thumbnail",
+    "normalize_thumbnails",
+    "popcount64",
+    "pack_hashes",
+    "hamming_distances",
+    "hamming_distance_matrix",
+    "top_k_indices",
+]
+
+
+def phash_opencv(img_gray, hash_size=8, highfreq_factor=4):
+    # type: (Union[Mat, np.ndarray], int, int) -> np.ndarray
+    """
+    Perceptual Hash computation.
+
+    Implementation follows
+    http://www.hackerfactor.com/blog/index.php?/archives/432-Looks-Like-It.html
+
+    Adapted from `imagehash.phash`, pure opencv implementation
+
+    The result is slightly different from `imagehash.phash`.
+    """
+    if hash_size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+
+    img_size = hash_size * highfreq_factor
+    image = cv2.resize(img_gray, (img_size, img_size), interpolation=cv2.INTER_LANCZOS4)
+    image = np.float32(image)
+    dct = cv2.dct(image)
+    dctlowfreq = dct[:hash_size, :hash_size]
+    med = np.median(dctlowfreq)
+    diff = dctlowfreq > med
+    return diff
+
+
+def phash_opencv_batch(imgs_gray, hash_size=8, highfreq_factor=4, *, packed=False):
+    # type: (Union[Sequence[Mat], np.ndarray], int, int, bool) -> np.ndarray
+    """
+    Perceptual Hash computation for many grayscale images at once.
+
+    `imgs_gray` is a sequence of images (sizes may differ) or an `(N, h, w)`
+    stack. The hashes are bit-identical to `phash_opencv`: every image is
+    resized in its own dtype and converted into one preallocated float32
+    buffer, the DCT runs through `cv2.dct` on the same float32 input, and the
+    median thresholding is done over the whole batch. (A matrix-multiply DCT
+    rounds differently from `cv2.dct` and flips bits of flat images, so it is
+    not used.)
+
+    Returns an `(N, hash_size, hash_size)` bool array, or the `(N, words)`
+    uint64 matrix of `pack_hashes` if `packed` is set.
+    """
+    if hash_size < 2:
+        raise ValueError("Hash size must be greater than or equal to 2")
+
+    img_size = hash_size * highfreq_factor
+    images = np.empty((len(imgs_gray), img_size, img_size), np.float32)
+    for i, img_gray in enumerate(imgs_gray):
+        if img_gray.ndim != 2:
+            raise ValueError(
+                f"Expected single channel images, got shape {img_gray.shape} "
+                f"at index {i}"
+            )
+        images[i] = cv2.resize(
+            img_gray, (img_size, img_size), interpolation=cv2.INTER_LANCZOS4
+        )
+
+    dctlowfreq = np.empty((len(images), hash_size, hash_size), np.float32)
+    for i, image in enumerate(images):
+        dctlowfreq[i] = cv2.dct(image)[:hash_size, :hash_size]
+    dctlowfreq = dctlowfreq.reshape(len(images), hash_size**2)
+    med = np.median(dctlowfreq, axis=1, keepdims=True)
+    diff = dctlowfreq > med
+    if packed:
+        return pack_hashes(diff)
+    return diff.reshape(len(images), hash_size, hash_size)
+
+
+def calculate_thumbnail(img_gray: Mat, thumbnail_size: int) -> np.ndarray:
+    """
+    A small grayscale thumbnail, stored next to the phash as a stronger
+    signature for reranking. Returns `thumbnail_size ** 2` uint8 values.
+    """
+    thumbnail = cv2.resize(
+        img_gray, (thumbnail_size, thumbnail_size), interpolation=cv2.INTER_AREA
+    )
+    return thumbnail.flatten()
+
+
+def normalize_thumbnails(thumbnails: np.ndarray) -> np.ndarray:
+    """
+    Zero-mean, unit-norm float32 rows, so that the dot product of two rows is
+    their normalized cross-correlation. Flat thumbnails become all zeros.
+    """
+    thumbnails = np.asarray(thumbnails, np.float32)
+    if thumbnails.ndim == 1:
+        thumbnails = thumbnails.reshape(1, -1)
+    thumbnails = thumbnails - thumbnails.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(thumbnails, axis=1, keepdims=True)
+    return np.divide(thumbnails, norms, out=np.zeros_like(thumbnails), where=norms > 0)
+
+
+def hamming_distance_sql_function(user_input, db_entry) -> int:
+    return np.count_nonzero(
+        np.frombuffer(user_input, bool) ^ np.frombuffer(db_entry, bool)
+    )
+
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount64(arr: np.ndarray) -> np.ndarray:
+    """
+    Count set bits of every element of a uint64 array.
+
+    Uses `np.bitwise_count` when available (numpy >= 2.0), otherwise a SWAR
+    popcount done with plain numpy integer operations.
+    """
+    bitwise_count = getattr(np, "bitwise_count", None)
+    if bitwise_count is not None:
+        return bitwise_count(arr)
+
+    arr = arr - ((arr >> np.uint64(1)) & _M1)
+    arr = (arr & _M2) + ((arr >> np.uint64(2)) & _M2)
+    arr = (arr + (arr >> np.uint64(4))) & _M4
+    return (arr * _H01) >> np.uint64(56)
+
+
+def pack_hashes(hashes: np.ndarray) -> np.ndarray:
+    """
+    Pack boolean hashes into rows of uint64 words.
+
+    `hashes` can be a single flattened hash, or a 2D `(n, bits)` array of
+    flattened hashes. Returns a C-contiguous `(n, words)` uint64 matrix, the
+    trailing padding bits are always zero.
+    """
+    hashes = np.asarray(hashes, dtype=bool)
+    if hashes.ndim == 1:
+        hashes = hashes.reshape(1, -1)
+
+    packed_bytes = np.packbits(hashes, axis=1)
+    words = -(-packed_bytes.shape[1] // 8)
+    padded = np.zeros((packed_bytes.shape[0], words * 8), np.uint8)
+    padded[:, : packed_bytes.shape[1]] = packed_bytes
+    return padded.view(np.uint64)
+
+
+def hamming_distances(query_packed: np.ndarray, hashes_packed: np.ndarray):
+    """
+    Hamming distances between one packed hash and every row of a packed
+    hash matrix, computed with a single XOR + popcount pass.
+    """
+    query_packed = query_packed.reshape(1, -1)
+    return popcount64(hashes_packed ^ query_packed).sum(axis=1, dtype=np.int64)
+
+
+def hamming_distance_matrix(queries_packed: np.ndarray, hashes_packed: np.ndarray):
+    """
+    `(m, n)` Hamming distance matrix between `m` packed query hashes and `n`
+    packed database hashes.
+    """
+    xor = queries_packed[:, np.newaxis, :] ^ hashes_packed[np.newaxis, :, :]
+    return popcount64(xor).sum(axis=2, dtype=np.int64)
+
+
+def top_k_indices(distances: np.ndarray, limit: int) -> np.ndarray:
+    """
+    Indices of the `limit` smallest distances along the last axis, ordered by
+    distance.
+
+    Ties are broken by index, so the result matches a stable sort of the whole
+    array while only partially partitioning it. `distances` can be 1D, or 2D
+    for a batch of queries.
+    """
+    total = distances.shape[-1]
+    limit = min(limit, total)
+    if limit <= 0:
+        return np.empty((*distances.shape[:-1], 0), np.intp)
+
+    keys = distances.astype(np.int64) * total + np.arange(total, dtype=np.int64)
+    if limit < total:
+        keys = np.take_along_axis(
+            keys, np.argpartition(keys, limit - 1, axis=-1)[..., :limit], axis=-1
+        )
+    keys.sort(axis=-1)
+    return (keys % total).astype(np.intp)
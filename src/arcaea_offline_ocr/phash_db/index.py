@@ -0,0 +1,140 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .hashing import hamming_distances, popcount64, top_k_indices
+
+__all__ = ["PhashMultiIndex"]
+
+
+_SUBSTRING_BITS = 16
+_SUBSTRING_VALUES = np.arange(1 << _SUBSTRING_BITS, dtype=np.uint16)
+_SUBSTRING_WEIGHTS = popcount64(_SUBSTRING_VALUES.astype(np.uint64))
+
+
+class PhashMultiIndex:
+    """
+    Multi-index hashing over 16-bit substrings of packed hashes.
+
+    Every hash is split into `m` substrings, indexed in a sorted lookup table.
+    If two hashes are within Hamming distance `d`, at least one of their
+    substrings is within `d // m` (pigeonhole), so probing each table with all
+    substrings within radius `s` finds every row within `m * (s + 1) - 1`.
+
+    The radius grows from 0 and stops as soon as the requested number of
+    results is guaranteed, so a query with an exact or near-exact match only
+    probes exact substrings. When the radius exceeds `max_substring_radius` or
+    too many rows become candidates, the search falls back to a brute force
+    scan, results are always identical to it.
+
+    Reference: Norouzi et al., Fast Search in Hamming Space with Multi-Index
+    Hashing, CVPR 2012.
+    """
+
+    def __init__(
+        self,
+        hashes_packed: np.ndarray,
+        hash_bits: int,
+        *,
+        max_substring_radius: int = 2,
+        brute_force_ratio: float = 0.5,
+    ):
+        self.hashes_packed = hashes_packed
+        self.hash_bits = hash_bits
+        self.max_substring_radius = max_substring_radius
+        self.brute_force_ratio = brute_force_ratio
+
+        self.substrings = -(-hash_bits // _SUBSTRING_BITS)
+        substring_values = hashes_packed.view(np.uint16)[:, : self.substrings]
+
+        # all substring tables live in one sorted array, keyed by
+        # `(substring_position << 16) | substring_value`
+        self.substring_offsets = (
+            np.arange(self.substrings, dtype=np.uint32) << _SUBSTRING_BITS
+        )
+        keys = (substring_values.astype(np.uint32) | self.substring_offsets).ravel()
+        order = np.argsort(keys, kind="stable")
+        self.table_keys = keys[order]
+        self.table_rows = (order // self.substrings).astype(np.intp)
+
+        self.probe_masks = [
+            _SUBSTRING_VALUES[_SUBSTRING_WEIGHTS == radius].astype(np.uint32)
+            for radius in range(max_substring_radius + 1)
+        ]
+
+    def __len__(self):
+        return self.hashes_packed.shape[0]
+
+    def _probe(self, query_substrings: np.ndarray, radius: int) -> np.ndarray:
+        probes = (
+            query_substrings.astype(np.uint32)[np.newaxis, :]
+            ^ self.probe_masks[radius][:, np.newaxis]
+        ) | self.substring_offsets
+        probes = probes.ravel()
+        lefts = np.searchsorted(self.table_keys, probes, "left")
+        lengths = np.searchsorted(self.table_keys, probes, "right") - lefts
+        total = lengths.sum()
+        offsets = np.repeat(lefts - np.cumsum(lengths) + lengths, lengths)
+        return self.table_rows[offsets + np.arange(total)]
+
+    def _brute_force(
+        self, query_packed: np.ndarray, limit: int, max_distance: Optional[int]
+    ):
+        distances = hamming_distances(query_packed, self.hashes_packed)
+        indices = top_k_indices(distances, limit)
+        distances = distances[indices]
+        if max_distance is not None:
+            within = distances <= max_distance
+            indices, distances = indices[within], distances[within]
+        return indices, distances
+
+    def search(
+        self,
+        query_packed: np.ndarray,
+        limit: int,
+        *,
+        max_distance: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the `limit` nearest rows of one packed hash, optionally only those
+        within `max_distance`.
+
+        Returns `(indices, distances)` ordered by distance, ties by row index.
+        """
+        query_packed = query_packed.reshape(1, -1)
+        total = len(self)
+        limit = min(limit, total)
+        if limit <= 0:
+            return np.empty(0, np.intp), np.empty(0, np.int64)
+
+        query_substrings = query_packed.view(np.uint16)[0, : self.substrings]
+        seen = np.zeros(total, bool)
+        candidates = np.empty(0, np.intp)
+        candidate_distances = np.empty(0, np.int64)
+
+        for radius in range(self.max_substring_radius + 1):
+            rows = np.unique(self._probe(query_substrings, radius))
+            rows = rows[~seen[rows]]
+            seen[rows] = True
+            if np.count_nonzero(seen) > total * self.brute_force_ratio:
+                break
+
+            candidates = np.concatenate([candidates, rows])
+            candidate_distances = np.concatenate(
+                [
+                    candidate_distances,
+                    hamming_distances(query_packed, self.hashes_packed[rows]),
+                ]
+            )
+
+            # every row within this distance has been seen
+            guaranteed = self.substrings * (radius + 1) - 1
+            if max_distance is not None:
+                guaranteed = min(guaranteed, max_distance)
+            complete = np.count_nonzero(candidate_distances <= guaranteed) >= limit
+            if complete or (max_distance is not None and guaranteed == max_distance):
+                order = np.lexsort((candidates, candidate_distances))
+                order = order[candidate_distances[order] <= guaranteed][:limit]
+                return candidates[order], candidate_distances[order]
+
+        return self._brute_force(query_packed, limit, max_distance)
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+from .database import ImagePhashDatabase
+
+__all__ = ["ReloadableImagePhashDatabase"]
+
+
+class ReloadableImagePhashDatabase:
+    """
+    A handle to an `ImagePhashDatabase` that picks up new builds of the same
+    file without restarting.
+
+    A new build is fully loaded into a separate `ImagePhashDatabase` and then
+    swapped in with a single reference assignment. Lookups that already
+    started keep running against the database they started with, and no
+    lookup can observe a half-loaded one. A failed load keeps the current
+    database.
+
+    Attributes that are not defined here are forwarded to the current
+    database, so the handle can be passed wherever an `ImagePhashDatabase` is
+    expected. Code that needs several consistent calls should take
+    `handle.database` once and use that.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        *,
+        poll_interval: Optional[float] = None,
+        **database_kwargs,
+    ):
+        """
+        :param poll_interval: if set, watch the database file from a background
+            thread every `poll_interval` seconds, see `start_watching`.
+        :param database_kwargs: passed to every `ImagePhashDatabase` load.
+        """
+        self.db_path = db_path
+        self.database_kwargs = database_kwargs
+        self.last_error: Optional[BaseException] = None
+
+        self.__reload_lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__watcher: Optional[threading.Thread] = None
+
+        self.__file_stamp = self._file_stamp()
+        self.__database = ImagePhashDatabase(db_path, **database_kwargs)
+
+        if poll_interval is not None:
+            self.start_watching(poll_interval)
+
+    @property
+    def database(self) -> ImagePhashDatabase:
+        return self.__database
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.database, name)
+
+    def _file_stamp(self) -> Tuple[int, int]:
+        stat = os.stat(self.db_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def read_built_timestamp(self) -> int:
+        with sqlite3.connect(self.db_path) as conn:
+            return int(
+                conn.execute(
+                    "SELECT value FROM properties WHERE key = 'built_timestamp'"
+                ).fetchone()[0]
+            )
+
+    def reload(self, *, force: bool = False) -> bool:
+        """
+        Load the database file and swap it in if its `built_timestamp` differs
+        from the current one, or unconditionally with `force`.
+
+        Returns whether a new database was swapped in.
+        """
+        with self.__reload_lock:
+            file_stamp = self._file_stamp()
+            if (
+                not force
+                and self.read_built_timestamp() == self.__database.built_timestamp
+            ):
+                self.__file_stamp = file_stamp
+                return False
+
+            database = ImagePhashDatabase(self.db_path, **self.database_kwargs)
+            self.__database = database
+            self.__file_stamp = file_stamp
+            return True
+
+    def check_for_update(self) -> bool:
+        """
+        Reload if the database file changed on disk since the last load.
+        Returns whether a new database was swapped in.
+        """
+        if self._file_stamp() == self.__file_stamp:
+            return False
+        return self.reload()
+
+    def _watch(self, poll_interval: float):
+        while not self.__stop_event.wait(poll_interval):
+            try:
+                self.check_for_update()
+                self.last_error = None
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # e.g. the file is being replaced, try again next time
+                self.last_error = e
+
+    def start_watching(self, poll_interval: float = 5.0):
+        """
+        Start a daemon thread that calls `check_for_update` every
+        `poll_interval` seconds. Errors are stored in `last_error`.
+        """
+        if self.__watcher is not None and self.__watcher.is_alive():
+            return
+
+        self.__stop_event.clear()
+        self.__watcher = threading.Thread(
+            target=self._watch,
+            args=(poll_interval,),
+            name=f"{self.__class__.__name__}-watcher",
+            daemon=True,
+        )
+        self.__watcher.start()
+
+    def stop_watching(self):
+        self.__stop_event.set()
+        if self.__watcher is not None:
+            self.__watcher.join()
+            self.__watcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop_watching()
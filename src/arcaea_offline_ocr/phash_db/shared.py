@@ -0,0 +1,129 @@
+from multiprocessing import shared_memory
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .database import ImagePhashDatabase, PhashArrays
+
+__all__ = [
+    "SharedPhashDatabaseDescriptor",
+    "SharedImagePhashDatabase",
+    "attach_shared_phash_database",
+]
+
+
+_PROPERTY_ATTRIBUTES = [
+    "hash_size",
+    "highfreq_factor",
+    "built_timestamp",
+    "thumbnail_size",
+]
+# `PhashArrays` fields stored as string arrays and read back as lists
+_ID_FIELDS = ["ids", "jacket_ids", "partner_icon_ids"]
+_ALIGNMENT = 64
+
+
+class SharedPhashDatabaseDescriptor(NamedTuple):
+    """
+    Everything a worker needs to attach to a `SharedImagePhashDatabase`.
+    Picklable, pass it to pool initializers.
+    """
+
+    shm_name: str
+    db_path: Optional[str]
+    properties: Dict[str, int]
+    arrays: Dict[str, Tuple[int, Tuple[int, ...], str]]
+    """`PhashArrays` field name -> (offset, shape, dtype)"""
+
+
+class SharedImagePhashDatabase:
+    """
+    Publish the hash matrices, thumbnails and id tables of an
+    `ImagePhashDatabase` into one `multiprocessing.shared_memory` block.
+
+    The publishing process owns the block and must keep this object alive
+    while workers use it, then `close` it. Workers call
+    `attach_shared_phash_database(descriptor)`.
+    """
+
+    def __init__(self, database: ImagePhashDatabase):
+        arrays: Dict[str, np.ndarray] = {}
+        for name, value in database.arrays._asdict().items():
+            if name in _ID_FIELDS:
+                arrays[name] = np.array(value, dtype=str)
+            elif value is not None:
+                arrays[name] = np.ascontiguousarray(value)
+
+        layout: Dict[str, Tuple[int, Tuple[int, ...], str]] = {}
+        size = 0
+        for name, array in arrays.items():
+            layout[name] = (size, array.shape, array.dtype.str)
+            size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, array in arrays.items():
+            offset, shape, dtype = layout[name]
+            np.ndarray(shape, dtype, buffer=self.shm.buf, offset=offset)[...] = array
+
+        self.descriptor = SharedPhashDatabaseDescriptor(
+            shm_name=self.shm.name,
+            db_path=database.db_path,
+            properties={k: getattr(database, k) for k in _PROPERTY_ATTRIBUTES},
+            arrays=layout,
+        )
+
+    def close(self):
+        """Release and unlink the shared memory block."""
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        # python 3.13+, the publishing process owns the block
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # older pythons register the block with the resource tracker, which
+        # is shared with the publisher for `multiprocessing` children
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_shared_phash_database(
+    descriptor: SharedPhashDatabaseDescriptor,
+    *,
+    use_index: bool = False,
+    cache_size: Optional[int] = None,
+) -> ImagePhashDatabase:
+    """
+    Attach to a `SharedImagePhashDatabase` from a worker process.
+
+    The hash matrices and thumbnails are read-only views of the shared block,
+    nothing is copied. Only the id lists are materialized per process. The
+    returned database supports all lookups. With `use_index`, each worker
+    builds its own `PhashMultiIndex`.
+
+    On python < 3.13, attach only from `multiprocessing` children of the
+    publishing process, so that they share its resource tracker.
+    """
+    shm = _attach_shared_memory(descriptor.shm_name)
+
+    arrays = {}
+    for name, (offset, shape, dtype) in descriptor.arrays.items():
+        array = np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[name] = array.tolist() if name in _ID_FIELDS else array
+
+    return ImagePhashDatabase.from_arrays(
+        PhashArrays(**arrays),
+        **descriptor.properties,
+        db_path=descriptor.db_path,
+        use_index=use_index,
+        cache_size=cache_size,
+        buffer_owner=shm,
+    )